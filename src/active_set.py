@@ -0,0 +1,39 @@
+from spatial_hash import SpatialHash
+from kilobot import neighbour_cell_size
+
+
+class ActiveSet:
+    # Splits the swarm into awake bots, updated every tick, and frozen bots, which never move or
+    # change again and only broadcast from a spatial hash that is built once
+    def __init__(self):
+        self.bots = None
+        self.awake = []
+        self.frozen = []
+        self.frozen_hash = None
+
+    def sync(self, bots):
+        # Rebuilds the sets when update_bots is given a different list of bots
+        if bots is self.bots and self.frozen_hash.cell_size == neighbour_cell_size():
+            return
+        self.bots = bots
+        self.awake = []
+        self.frozen = []
+        self.frozen_hash = SpatialHash(neighbour_cell_size())
+        for bot in bots:
+            if bot.is_frozen():
+                self._freeze(bot)
+            else:
+                self.awake.append(bot)
+
+    def freeze_settled(self):
+        awake = []
+        for bot in self.awake:
+            if bot.is_frozen():
+                self._freeze(bot)
+            else:
+                awake.append(bot)
+        self.awake = awake
+
+    def _freeze(self, bot):
+        self.frozen.append(bot)
+        self.frozen_hash.insert(bot)
@@ -0,0 +1,263 @@
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+from results import ResultsStore
+from atomic_file import atomic_write
+
+PERCENTILES = (5, 25, 50, 75, 95) # Percentiles of the error curves, join times and final errors
+CONFIDENCE_Z = 1.96 # Normal quantile of the 95% confidence bands of the means
+RUN_COLUMNS = ("average_error", "bots", "time") # One value per run, average_error is the final shape error
+SERIES_COLUMNS = ("errors", "join_times") # One value per joined bot
+CACHE_VERSION = 1
+PREFIX_CHECK = 65536 # Bytes at the start of the results file whose hash tells if it was replaced
+
+
+class RunAnalysis:
+    # Error curves, join times and final errors of the runs of a results file, grouped by configuration.
+    # The runs are streamed from the file and kept as flat NumPy arrays, which are cached next to the
+    # file with the byte offset read up to, so update only reads the runs appended since.
+    def __init__(self, runs_file=None, cache_file=None):
+        self.store = ResultsStore(runs_file) if runs_file else None
+        self.cache_file = cache_file
+        if runs_file and cache_file is None:
+            self.cache_file = os.path.splitext(runs_file)[0] + "_analysis.npz"
+        self.offset = 0 # Bytes of the results file read
+        self.configurations = [] # Names, indexed by the configuration column
+        self.columns = {"configuration": np.empty(0, np.int64), **{name: np.empty(0) for name in RUN_COLUMNS}}
+        self.series = {name: np.empty(0) for name in SERIES_COLUMNS}
+        self.offsets = {name: np.zeros(1, np.int64) for name in SERIES_COLUMNS} # Run i is values[offsets[i]:offsets[i + 1]]
+        if self.cache_file:
+            self._load_cache()
+
+    def __len__(self):
+        return len(self.columns["configuration"])
+
+    def update(self):
+        # Reads the runs appended to the results file since the last update and returns how many
+        if self.store is None:
+            return 0
+        records = []
+        offset = self.offset
+        for offset, record in self.store.runs_from(self.offset, ("test_name", "params") + RUN_COLUMNS + SERIES_COLUMNS):
+            records.append(record)
+        self.offset = offset
+        self.add(records)
+        if records and self.cache_file:
+            self._save_cache()
+        return len(records)
+
+    def add(self, records):
+        indices = {name: i for i, name in enumerate(self.configurations)}
+        configurations = []
+        for record in records:
+            name = configuration_name(record)
+            if name not in indices:
+                indices[name] = len(self.configurations)
+                self.configurations.append(name)
+            configurations.append(indices[name])
+        if not configurations:
+            return
+
+        self.columns["configuration"] = np.concatenate((self.columns["configuration"], configurations))
+        for name in RUN_COLUMNS:
+            values = [record.get(name) for record in records]
+            self.columns[name] = np.concatenate((self.columns[name], np.array(values, dtype=float)))
+        for name in SERIES_COLUMNS:
+            series = [record.get(name) or [] for record in records]
+            lengths = np.cumsum([len(values) for values in series]) + self.offsets[name][-1]
+            self.series[name] = np.concatenate([self.series[name]] + [np.asarray(values, dtype=float) for values in series])
+            self.offsets[name] = np.concatenate((self.offsets[name], lengths))
+
+    def runs_of(self, configuration):
+        return np.flatnonzero(self.columns["configuration"] == self.configurations.index(configuration))
+
+    def curves(self, runs, name="errors"):
+        # (runs, longest series) array of the series of the runs, padded with NaN
+        starts = self.offsets[name][runs]
+        lengths = self.offsets[name][runs + 1] - starts
+        curves = np.full((len(runs), lengths.max(initial=0)), np.nan)
+        rows = np.repeat(np.arange(len(runs)), lengths)
+        columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        curves[rows, columns] = self.series[name][np.repeat(starts, lengths) + columns]
+        return curves
+
+    def summary(self, configuration):
+        runs = self.runs_of(configuration)
+        curves = self.curves(runs)
+        join_times = self.curves(runs, "join_times")
+        join_times = join_times[~np.isnan(join_times)]
+        final_errors = self.columns["average_error"][runs]
+        final_errors = final_errors[~np.isnan(final_errors)]
+        return {
+            "configuration": configuration,
+            "runs": len(runs),
+            "bots": _mean(self.columns["bots"][runs]),
+            "time": _mean(self.columns["time"][runs]),
+            "final_error": _mean(final_errors),
+            "final_error_ci": _confidence(final_errors),
+            "final_error_percentiles": _percentiles(final_errors),
+            "join_time_percentiles": _percentiles(join_times),
+            "error_curve": error_bands(curves),
+        }
+
+    def report(self):
+        return [self.summary(configuration) for configuration in self.configurations]
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with np.load(self.cache_file) as cache:
+                arrays = dict(cache)
+        except (OSError, ValueError):
+            return
+        if int(arrays["version"]) != CACHE_VERSION or arrays["prefix_hash"] != self._prefix_hash(int(arrays["offset"])):
+            return # Written by another version or for a results file that was replaced, read everything again
+        self.offset = int(arrays["offset"])
+        self.configurations = arrays["configurations"].tolist()
+        for name in self.columns:
+            self.columns[name] = arrays[name]
+        for name in SERIES_COLUMNS:
+            self.series[name] = arrays[name]
+            self.offsets[name] = arrays[f"{name}_offsets"]
+
+    def _save_cache(self):
+        arrays = {
+            "version": CACHE_VERSION,
+            "offset": self.offset,
+            "prefix_hash": self._prefix_hash(self.offset),
+            "configurations": np.array(self.configurations, dtype=str),
+            **self.columns,
+            **self.series,
+            **{f"{name}_offsets": offsets for name, offsets in self.offsets.items()},
+        }
+        with atomic_write(self.cache_file) as f:
+            np.savez(f, **arrays)
+
+    def _prefix_hash(self, offset):
+        if not os.path.exists(self.store.runs_file) or os.path.getsize(self.store.runs_file) < offset:
+            return ""
+        with open(self.store.runs_file, "rb") as f:
+            return hashlib.sha256(f.read(min(offset, PREFIX_CHECK))).hexdigest()
+
+
+def configuration_name(record):
+    # Runs of a sweep are grouped by their swept parameters, other runs by their test name
+    params = record.get("params")
+    name = record.get("test_name")
+    if params:
+        values = ", ".join(f"{key}={value}" for key, value in sorted(params.items()))
+        return f"{name} {values}" if name else values
+    return name or "unnamed"
+
+
+def error_bands(curves):
+    # Percentiles, mean and 95% confidence band of the mean at every number of joined bots, over the
+    # runs that got that many bots to join
+    counts = np.sum(~np.isnan(curves), axis=0)
+    if curves.size == 0:
+        return {"runs": counts, "mean": np.empty(0), "ci": np.empty(0), "percentiles": np.empty((len(PERCENTILES), 0))}
+    mean = np.nanmean(curves, axis=0)
+    std = np.sqrt(np.nanmean((curves - mean) ** 2, axis=0))
+    return {
+        "runs": counts,
+        "mean": mean,
+        "ci": CONFIDENCE_Z * std / np.sqrt(counts),
+        "percentiles": np.nanpercentile(curves, PERCENTILES, axis=0),
+    }
+
+
+def load_output_info(json_file):
+    # Runs of an old output_info.json file, one per test name
+    with open(json_file) as f:
+        data = json.load(f)
+    return [{"test_name": test_name, **info} for test_name, info in data.items()]
+
+
+def plot_error_bands(analysis, configurations, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    figure, axes = plt.subplots()
+    for configuration in configurations:
+        bands = error_bands(analysis.curves(analysis.runs_of(configuration)))
+        bots = np.arange(1, len(bands["mean"]) + 1)
+        line, = axes.plot(bots, bands["percentiles"][PERCENTILES.index(50)], label=configuration)
+        axes.fill_between(bots, bands["percentiles"][0], bands["percentiles"][-1], color=line.get_color(), alpha=0.2)
+    axes.set_xlabel("Robots placed")
+    axes.set_ylabel("Error")
+    axes.set_title(f"Median error, {PERCENTILES[0]}th to {PERCENTILES[-1]}th percentile")
+    axes.legend()
+    figure.savefig(path)
+    plt.close(figure)
+
+
+def _mean(values):
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if len(values) else float("nan")
+
+
+def _confidence(values):
+    return float(CONFIDENCE_Z * values.std() / np.sqrt(len(values))) if len(values) > 1 else float("nan")
+
+
+def _percentiles(values):
+    if not len(values):
+        return {percentile: float("nan") for percentile in PERCENTILES}
+    return dict(zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()))
+
+
+def _json_value(value):
+    if isinstance(value, np.ndarray):
+        return np.where(np.isnan(value), None, value).tolist() if value.dtype.kind == "f" else value.tolist()
+    if isinstance(value, dict):
+        return {str(key): _json_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_json_value(item) for item in value]
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise the runs of a results file by configuration")
+    parser.add_argument("runs_file", help="JSON Lines results file, or an old output_info.json file")
+    parser.add_argument("--configuration", action="append", default=None, help="Only report this configuration, can be repeated")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="Read every run again and do not write the cache")
+    parser.add_argument("--json", default=None, metavar="FILE", help="Write the full report, error curves included, to this file")
+    parser.add_argument("--plot", default=None, metavar="FILE", help="Plot the error curves of the configurations to this image")
+    args = parser.parse_args(argv)
+
+    if args.runs_file.endswith(".json"):
+        analysis = RunAnalysis()
+        analysis.add(load_output_info(args.runs_file))
+    else:
+        analysis = RunAnalysis(args.runs_file, None if args.use_cache else "")
+        new = analysis.update()
+        print(f"{len(analysis)} runs, {new} new")
+    unknown = [configuration for configuration in args.configuration or [] if configuration not in analysis.configurations]
+    if unknown:
+        parser.error(f"unknown configuration {', '.join(unknown)}, one of: {', '.join(analysis.configurations)}")
+    configurations = args.configuration or analysis.configurations
+    report = [analysis.summary(configuration) for configuration in configurations]
+
+    median, high = PERCENTILES.index(50), len(PERCENTILES) - 1
+    width = max([len("Configuration")] + [len(configuration) for configuration in configurations])
+    print(f"{'Configuration':<{width}} {'Runs':>5} {'Bots':>7} {'Time (s)':>9} {'Error':>7} {'95% CI':>7} "
+          f"{'Join p50':>9} {f'Join p{PERCENTILES[high]}':>9}")
+    for summary in report:
+        joins = list(summary["join_time_percentiles"].values())
+        print(f"{summary['configuration']:<{width}} {summary['runs']:>5} {summary['bots']:>7.1f} {summary['time']:>9.0f} "
+              f"{summary['final_error']:>7.2f} {summary['final_error_ci']:>7.2f} {joins[median]:>9.0f} {joins[high]:>9.0f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(_json_value({"percentiles": list(PERCENTILES), "configurations": report}), f)
+    if args.plot:
+        plot_error_bands(analysis, configurations, args.plot)
+
+
+if __name__ == "__main__":
+    main()
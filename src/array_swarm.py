@@ -0,0 +1,416 @@
+from math import inf, pi
+import numpy as np
+import kilobot
+from kilobot import Kilobot, KilobotState, NeighbourRecord
+from noise import Noise
+
+# Integer state codes used by the array engine
+START = KilobotState.START.value
+WAIT_TO_MOVE = KilobotState.WAIT_TO_MOVE.value
+MOVE_WHILE_OUTSIDE = KilobotState.MOVE_WHILE_OUTSIDE.value
+MOVE_WHILE_INSIDE = KilobotState.MOVE_WHILE_INSIDE.value
+JOINED_SHAPE = KilobotState.JOINED_SHAPE.value
+
+SEED_COLOR = "#00848f"
+STATE_COLORS = [Kilobot.colors_dict[KilobotState(code)] for code in range(len(KilobotState))]
+SWARM_FIELDS = ("ids", "pos", "rotation", "state", "gradient", "percieved_pos", "forward_speed", "rotation_speed",
+                "timer", "prev_distance", "activation_index", "is_seed", "updates_gradient",
+                "iterations_inside_shape", "use_localise", "joined_shape_time", "selected") # One row per bot
+
+
+class ArrayBotView:
+    # Kilobot-like view of one row of an ArraySwarm, so draw_bots and the main loop can use it
+    def __init__(self, swarm, index):
+        self.swarm = swarm
+        self.index = index
+
+    @property
+    def id(self):
+        return int(self.swarm.ids[self.index])
+
+    @property
+    def pos(self):
+        return tuple(self.swarm.pos[self.index])
+
+    @property
+    def percieved_pos(self):
+        return tuple(self.swarm.percieved_pos[self.index])
+
+    @property
+    def rotation(self):
+        return float(self.swarm.rotation[self.index])
+
+    @property
+    def gradient(self):
+        gradient = self.swarm.gradient[self.index]
+        return int(gradient) if gradient != inf else inf
+
+    @property
+    def state(self):
+        return KilobotState(int(self.swarm.state[self.index]))
+
+    @property
+    def is_seed(self):
+        return bool(self.swarm.is_seed[self.index])
+
+    @property
+    def color(self):
+        if self.swarm.is_seed[self.index]:
+            return SEED_COLOR
+        return STATE_COLORS[self.swarm.state[self.index]]
+
+    @property
+    def selected_bot(self):
+        return bool(self.swarm.selected[self.index])
+
+    @selected_bot.setter
+    def selected_bot(self, value):
+        self.swarm.selected[self.index] = value
+
+    @property
+    def neighbours(self):
+        return self.swarm.neighbours_of(self.index)
+
+    draw_additional_info = Kilobot.draw_additional_info
+    location_error = Kilobot.location_error
+    _real_distance_to = Kilobot._real_distance_to
+
+
+class ArraySwarm:
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.ids = np.arange(n, dtype=np.int64)
+        self.pos = np.zeros((n, 2))
+        self.rotation = np.zeros(n)
+        self.state = np.full(n, START, dtype=np.int8)
+        self.gradient = np.full(n, inf)
+        self.percieved_pos = np.zeros((n, 2))
+        self.forward_speed = np.full(n, float(kilobot.KILOBOT_FORWARD_SPEED_MEAN))
+        self.rotation_speed = np.full(n, float(kilobot.KILOBOT_ROTATION_SPEED_MEAN))
+        self.timer = np.zeros(n)
+        self.prev_distance = np.full(n, inf)
+        self.activation_index = np.full(n, inf)
+        self.is_seed = np.zeros(n, dtype=bool)
+        self.updates_gradient = np.ones(n, dtype=bool)
+        self.iterations_inside_shape = np.zeros(n, dtype=np.int32)
+        self.use_localise = np.ones(n, dtype=bool)
+        self.joined_shape_time = np.zeros(n)
+        self.selected = np.zeros(n, dtype=bool)
+        self.next_activation_index = 0
+        self.noise = Noise(seed)
+        self.receivers = np.zeros(0, dtype=np.int64) # Neighbour records of the last tick, sorted by receiver
+        self.senders = np.zeros(0, dtype=np.int64)
+        self.distances = np.zeros(0)
+        self.pairs_evaluated = 0 # Candidate pairs of the last tick
+        self.records_allocated = 0 # Neighbour records of every tick so far
+        self._views = None
+
+    @classmethod
+    def from_kilobots(cls, bots, seed=None):
+        swarm = cls(len(bots), seed)
+        for i, bot in enumerate(bots):
+            swarm.ids[i] = bot.id
+            swarm.pos[i] = bot.pos
+            swarm.rotation[i] = bot.rotation
+            swarm.state[i] = bot.state.value
+            swarm.gradient[i] = bot.gradient
+            swarm.percieved_pos[i] = bot.percieved_pos
+            swarm.forward_speed[i] = bot.forwad_speed
+            swarm.rotation_speed[i] = bot.rotation_speed
+            swarm.timer[i] = bot.timer
+            swarm.prev_distance[i] = bot.prev_distance
+            swarm.activation_index[i] = bot.activation_index
+            swarm.is_seed[i] = bot.is_seed
+            swarm.updates_gradient[i] = bot.updates_gradient
+            swarm.iterations_inside_shape[i] = bot.iterations_inside_shape
+            swarm.use_localise[i] = bot.use_localise
+            swarm.joined_shape_time[i] = bot.joined_shape_time
+            swarm.selected[i] = bot.selected_bot
+        swarm.next_activation_index = Kilobot.next_activation_index
+        return swarm
+
+    @property
+    def bots(self):
+        if self._views is None:
+            self._views = [ArrayBotView(self, i) for i in range(self.n)]
+        return self._views
+
+    def neighbours_of(self, index):
+        start, end = np.searchsorted(self.receivers, [index, index + 1])
+        neighbours = []
+        for sender, distance in zip(self.senders[start:end], self.distances[start:end]):
+            record = NeighbourRecord()
+            record.id = int(self.ids[sender])
+            record.distance = float(distance)
+            record.gradient = self.bots[sender].gradient
+            record.state = self.bots[sender].state
+            record.activation_index = float(self.activation_index[sender])
+            record.pos = tuple(self.percieved_pos[sender])
+            record.bot = self.bots[sender]
+            neighbours.append(record)
+        return neighbours
+
+    def remove_bots_not_forming_shape(self):
+        self._keep(self.state == JOINED_SHAPE)
+
+    def update_bots(self, dt, shape, enable_trilateration=False, profiler=None):
+        n = self.n
+        laps = profiler.laps() if profiler is not None else None
+        receivers, senders, distances = self._update_neighbours()
+        if laps: laps.lap("neighbours")
+        counts = np.bincount(receivers, minlength=n)
+        starts = np.cumsum(counts) - counts
+
+        # Neighbour records hold the state of the sender at the start of the tick
+        sender_state = self.state[senders]
+        sender_gradient = self.gradient[senders]
+        sender_activation_index = self.activation_index[senders]
+        sender_pos = self.percieved_pos[senders]
+        sender_moving = (sender_state == MOVE_WHILE_INSIDE) | (sender_state == MOVE_WHILE_OUTSIDE)
+        state = self.state.copy()
+
+        def segment_min(values, mask):
+            return _segment_reduce(np.minimum, np.where(mask, values, inf), counts, starts, inf)
+
+        def segment_max(values, mask):
+            return _segment_reduce(np.maximum, np.where(mask, values, -inf), counts, starts, -inf)
+
+        # Gradient formation
+        stationary = ((sender_state == JOINED_SHAPE) | (sender_state == WAIT_TO_MOVE)) & (distances < kilobot.GRADIENT_DISTANCE)
+        min_gradient = segment_min(sender_gradient, stationary)
+        forms_gradient = self.updates_gradient & ~self.is_seed
+        self.gradient[forms_gradient] = min_gradient[forms_gradient] + 1
+        self.gradient[self.is_seed] = 0
+        if laps: laps.lap("gradient")
+
+        # Localisation
+        if enable_trilateration:
+            self._localise(receivers, sender_state, sender_pos, distances, state, enable_trilateration == kilobot.LEAST_SQUARES)
+        else:
+            not_joined = state != JOINED_SHAPE
+            self.percieved_pos[not_joined] = self.pos[not_joined]
+        if laps: laps.lap("localise")
+
+        # START
+        starting = state == START
+        self.state[starting & self.is_seed] = JOINED_SHAPE
+        starting &= ~self.is_seed
+        self.timer[starting] += dt
+        self.state[starting & (self.timer > kilobot.STARTUP_TIME)] = WAIT_TO_MOVE
+
+        # WAIT_TO_MOVE
+        waiting = state == WAIT_TO_MOVE
+        any_moving = np.bincount(receivers[sender_moving], minlength=n) > 0
+        waiting_neighbour = sender_state == WAIT_TO_MOVE
+        highest_gradient = segment_max(sender_gradient, waiting_neighbour)
+        highest_gradient_neighbour = waiting_neighbour & (sender_gradient == highest_gradient[receivers])
+        highest_id = segment_max(self.ids[senders].astype(float), highest_gradient_neighbour)
+        starts_moving = (counts == 0) | (~any_moving & (
+            (highest_gradient == -inf) | (self.gradient > highest_gradient) | ((self.gradient == highest_gradient) & (self.ids > highest_id))))
+        self.state[waiting & starts_moving] = MOVE_WHILE_OUTSIDE
+
+        # MOVE_WHILE_OUTSIDE
+        outside = state == MOVE_WHILE_OUTSIDE
+        self._activate(outside & (self.activation_index == inf))
+        inside_shape = shape.contains_many(self.percieved_pos)
+        self.iterations_inside_shape[outside & inside_shape] += 1
+        self.iterations_inside_shape[outside & ~inside_shape] = 0
+        entering = outside & inside_shape & (self.iterations_inside_shape > 10)
+        self.state[entering] = MOVE_WHILE_INSIDE
+
+        # MOVE_WHILE_INSIDE
+        inside = state == MOVE_WHILE_INSIDE
+        closest = _segment_argmin(distances, counts, starts)
+        has_neighbours = counts > 0
+        closest_gradient = np.full(n, np.nan)
+        closest_gradient[has_neighbours] = sender_gradient[closest[has_neighbours]]
+        joining = inside & (~inside_shape | (self.gradient == closest_gradient))
+        self.state[joining] = JOINED_SHAPE
+        self.joined_shape_time[joining] = 0
+
+        # Edge following of both moving states, yielding to bots that started moving earlier
+        moving = (outside & ~entering) | inside
+        prior = sender_moving & (sender_activation_index < self.activation_index[receivers])
+        follows_edge = moving & (segment_min(distances, prior) > kilobot.YIELD_DISTANCE)
+        current = segment_min(distances, ~sender_moving)
+        self._follow_edge(follows_edge, current, receivers, senders, dt)
+
+        # JOINED_SHAPE
+        joined = state == JOINED_SHAPE
+        self.updates_gradient[joined] = False
+        localising = joined & self.use_localise
+        self.joined_shape_time[localising] += dt
+        self.use_localise[localising & (self.joined_shape_time > kilobot.LOCALISE_TIME_AFTER_JOINING)] = False
+        if laps:
+            laps.lap("assembly")
+            profiler.count_tick(self.bots, self.pairs_evaluated, self.records_allocated)
+
+    def _update_neighbours(self):
+        # Every bot broadcasts to every other bot within the (noisy) broadcast radius
+        max_distance = kilobot.neighbour_cell_size()
+        receivers, senders = self._candidate_pairs(max_distance)
+        self.pairs_evaluated = len(receivers)
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        dx = x[receivers] - x[senders]
+        dy = y[receivers] - y[senders]
+        squared_distances = dx * dx + dy * dy
+        in_range = squared_distances <= max_distance * max_distance
+        receivers, senders = receivers[in_range], senders[in_range]
+        distances = np.sqrt(squared_distances[in_range])
+        if not kilobot.DISABLE_DISTANCE_ERROR:
+            distances *= 1 + self._errors("distance", kilobot.DISTANCE_ERROR, receivers, senders)
+        heard = distances <= kilobot.BROADCAST_RADIUS
+        self.candidate_receivers = receivers
+        self.candidate_senders = senders
+        self.receivers, self.senders, self.distances = receivers[heard], senders[heard], distances[heard]
+        self.records_allocated += len(self.receivers)
+        return self.receivers, self.senders, self.distances
+
+    def _localise(self, receivers, sender_state, sender_pos, distances, state, least_squares=False):
+        localises = ~self.is_seed & ~((state == JOINED_SHAPE) & ~self.use_localise)
+        joined_neighbour = sender_state == JOINED_SHAPE
+        joined_counts = np.bincount(receivers[joined_neighbour], minlength=self.n)
+        records = joined_neighbour & localises[receivers] & (joined_counts[receivers] >= 3)
+        record_receivers = receivers[records]
+        record_pos = sender_pos[records]
+        record_distances = distances[records]
+        if len(record_receivers) == 0:
+            return
+        if least_squares:
+            kilobot.least_squares_localise(self.percieved_pos, record_receivers, record_pos, record_distances)
+            return
+
+        # Corrections are applied one neighbour at a time, in the order the records were received
+        counts = np.bincount(record_receivers, minlength=self.n)
+        rank = np.arange(len(record_receivers)) - (np.cumsum(counts) - counts)[record_receivers]
+        for k in range(counts.max()):
+            step = rank == k
+            bots = record_receivers[step]
+            neighbour_pos = record_pos[step]
+            v = self.percieved_pos[bots] - neighbour_pos
+            c = np.linalg.norm(v, axis=1)
+            valid = c > 0
+            self.percieved_pos[bots[valid]] = neighbour_pos[valid] + record_distances[step][valid, None] * v[valid] / c[valid, None]
+
+    # Overridden by the tiles of partitioned.py, which only update part of the swarm
+    def _candidate_pairs(self, max_distance):
+        return _candidate_pairs(self.pos, max_distance)
+
+    def _errors(self, name, error, bots, others=None):
+        # Relative errors of the bots, or of the records from others to bots, in the order given
+        return self.noise.draw(name, len(bots), error)
+
+    def _activate(self, activating):
+        activated = np.count_nonzero(activating)
+        self.activation_index[activating] = np.arange(self.next_activation_index, self.next_activation_index + activated)
+        self.next_activation_index += activated
+
+    def _exchange_moves(self, moved, old_pos):
+        pass
+
+    def _exchange_blocked(self, blocked, previous):
+        # Whether any bot changed between blocked and free in the last round of collision checks
+        return not np.array_equal(blocked, previous)
+
+    def _follow_edge(self, follows_edge, current, receivers, senders, dt):
+        bots = np.flatnonzero(follows_edge)
+        near = current[bots] < kilobot.DESIRED_DISTANCE
+        prev_distance = self.prev_distance[bots]
+        rotate_left = near & ~(prev_distance < current[bots])
+        rotate_right = ~near & ~(prev_distance > current[bots])
+        self._move_straight(bots, dt)
+        self._rotate(bots[rotate_left], -1, dt)
+        self._rotate(bots[rotate_right], 1, dt)
+        self.prev_distance[bots] = current[bots]
+
+    def _move_straight(self, bots, dt):
+        distance = self.forward_speed[bots] * dt
+        if not kilobot.DISABLE_MOVEMENT_ERROR:
+            distance *= 1 + self._errors("forward", kilobot.KILOBOT_FORWARD_SPEED_ERROR, bots)
+        old_pos = self.pos.copy()
+        moved = np.zeros(self.n, dtype=bool)
+        moved[bots] = True
+        self.pos[bots, 0] += distance * np.cos(self.rotation[bots])
+        self.pos[bots, 1] += distance * np.sin(self.rotation[bots])
+        self._exchange_moves(moved, old_pos)
+
+        # Bots are updated in order, so a bot sees where the bots before it ended up, which is their old
+        # position if they were blocked themselves. Resolved again until no bot changes from blocked to free.
+        receivers, senders = self.candidate_receivers, self.candidate_senders
+        pairs = moved[receivers]
+        receivers, senders = receivers[pairs], senders[pairs]
+        earlier = moved[senders] & (senders < receivers)
+        collides_new = np.linalg.norm(self.pos[receivers] - self.pos[senders], axis=1) < 2 * kilobot.KILOBOT_RADIUS
+        collides_old = np.linalg.norm(self.pos[receivers] - old_pos[senders], axis=1) < 2 * kilobot.KILOBOT_RADIUS
+        blocked = np.zeros(self.n, dtype=bool)
+        changed = True
+        while changed:
+            colliding = np.where(earlier & ~blocked[senders], collides_new, collides_old)
+            resolved = np.zeros(self.n, dtype=bool)
+            resolved[receivers[colliding]] = True
+            changed = self._exchange_blocked(resolved, blocked)
+            blocked = resolved
+        self.pos[blocked] = old_pos[blocked]
+
+    def _rotate(self, bots, direction, dt):
+        rotation = self.rotation_speed[bots] * dt
+        error = 0
+        if not kilobot.DISABLE_MOVEMENT_ERROR:
+            error = self._errors("rotation", kilobot.KILOBOT_ROTATION_SPEED_ERROR, bots) * rotation
+        self.rotation[bots] = (self.rotation[bots] + direction * rotation + error) % (2 * pi)
+
+    def _keep(self, keep):
+        for name in SWARM_FIELDS:
+            setattr(self, name, getattr(self, name)[keep])
+        self.n = len(self.ids)
+        self.receivers = np.zeros(0, dtype=np.int64)
+        self.senders = np.zeros(0, dtype=np.int64)
+        self.distances = np.zeros(0)
+        self._views = None
+
+
+def _candidate_pairs(pos, max_distance, subdivisions=2):
+    # All ordered pairs of different bots that may be within max_distance, sorted by receiver.
+    # Bots are sorted by cell with the cells of one column stored contiguously, so the candidates of
+    # a bot are one contiguous range of sorted bots per neighbouring column.
+    n = len(pos)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    cells = np.floor(pos / (max_distance / subdivisions)).astype(np.int64)
+    cells -= cells.min(axis=0) - subdivisions
+    height = cells[:, 1].max() + subdivisions + 1
+    keys = cells[:, 0] * height + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    columns = np.arange(-subdivisions, subdivisions + 1) * height
+    starts = np.searchsorted(sorted_keys, keys[:, None] + columns - subdivisions, "left")
+    ends = np.searchsorted(sorted_keys, keys[:, None] + columns + subdivisions, "right")
+    counts = (ends - starts).ravel()
+    offsets = np.repeat(starts.ravel() - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+    receivers = np.repeat(np.arange(n), (ends - starts).sum(axis=1))
+    senders = order[offsets]
+    different = receivers != senders
+    return receivers[different], senders[different]
+
+
+def _segment_reduce(ufunc, values, counts, starts, fill):
+    out = np.full(len(counts), fill, dtype=float)
+    non_empty = counts > 0
+    if non_empty.any():
+        out[non_empty] = ufunc.reduceat(values, starts[non_empty])
+    return out
+
+
+def _segment_argmin(values, counts, starts):
+    # Index of the first minimum value of every segment
+    minimum = _segment_reduce(np.minimum, values, counts, starts, inf)
+    receivers = np.repeat(np.arange(len(counts)), counts)
+    is_min = values == minimum[receivers]
+    first = np.full(len(counts), len(values))
+    np.minimum.at(first, receivers[is_min], np.flatnonzero(is_min))
+    return first
+
+
+def generate_array_swarm(shape_origin, rows, cols, seed=None):
+    return ArraySwarm.from_kilobots(kilobot.generate_kilobots(shape_origin, rows, cols), seed)
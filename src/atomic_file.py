@@ -0,0 +1,33 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode="wb", sync=False):
+    # Yields a temporary file next to path that replaces path once the block ends, so readers and
+    # interrupted writes never leave a partial file. Every process writes its own temporary file, so
+    # parallel writers of the same path do not clobber each other. sync flushes it to disk first.
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, mode) as f:
+            yield f
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def write_all(fd, data):
+    # os.write may write only part of data, the rest is written until nothing is left
+    data = memoryview(data)
+    while data:
+        data = data[os.write(fd, data):]
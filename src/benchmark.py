@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import pygame
+from noise import Noise
+from kilobot import Kilobot, update_bots, update_neighbours, draw_movement_noise, draw_bots, generate_kilobots, localise_least_squares, LEAST_SQUARES
+from array_swarm import ArraySwarm
+from partitioned import PartitionedSwarm
+from active_set import ActiveSet
+from shape_mask import load_compiled_shape
+
+try:
+    import resource
+except ImportError: # Not available on Windows, peak memory is not measured there
+    resource = None
+
+DEFAULT_SIZES = (50, 200, 1000, 2000, 5000, 10000)
+DEFAULT_IMAGE_FILE = "shapes/arrow.png"
+DEFAULT_TICKS = 10
+DEFAULT_WARMUP_TIME = 3 # Simulated seconds before measuring, past STARTUP_TIME so the first bots move
+DEFAULT_DT = 0.1
+DEFAULT_THRESHOLD = 0.1 # Relative slowdown that counts as a regression
+MIN_REGRESSION_SECONDS = 0.0005 # Slowdowns smaller than this are timer noise
+SCREEN_SIZE = (1280, 720)
+PHASES = ("update_neighbours", "form_gradient", "localise", "self_assembly", "update_color")
+
+
+def build_swarm(size, shape, seed):
+    # Seed bots plus a grid of about size bots in front of the origin of the shape
+    Kilobot.noise = Noise(seed)
+    Kilobot.next_id = 0
+    Kilobot.next_activation_index = 0
+    cols = max(round((size - 4) ** 0.5), 1)
+    rows = max(round((size - 4) / cols), 1)
+    return generate_kilobots(shape.origin, rows, cols)
+
+
+def phase_tick(bots, dt, shape, enable_trilateration):
+    # Same updates as update_bots without the active set and gradient field, one loop per phase. Every
+    # phase only reads the neighbour records of the tick, so the split does not change the result.
+    times = {}
+    start = time.perf_counter()
+    update_neighbours(bots)
+    draw_movement_noise(bots)
+    times["update_neighbours"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for bot in bots:
+        bot.form_gradient()
+    times["form_gradient"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if enable_trilateration == LEAST_SQUARES:
+        localise_least_squares(bots)
+    else:
+        for bot in bots:
+            bot.localise() if enable_trilateration else bot.perfect_localise()
+    times["localise"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for bot in bots:
+        bot.self_assembly(dt, shape)
+    times["self_assembly"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for bot in bots:
+        bot.update_color()
+    times["update_color"] = time.perf_counter() - start
+    return times
+
+
+def benchmark_size(size, image_file=DEFAULT_IMAGE_FILE, ticks=DEFAULT_TICKS, warmup_time=DEFAULT_WARMUP_TIME, dt=DEFAULT_DT,
+                   seed=0, enable_trilateration=True, use_array_engine=False, use_active_set=True, workers=None):
+    # Runs in its own process, so the peak memory is the one of this swarm size
+    shape = load_compiled_shape(image_file)
+
+    # Memory of the swarm, with the neighbour records of its first tick, is traced apart from the timings
+    tracemalloc.start()
+    bots = build_swarm(size, shape, seed)
+    swarm = ArraySwarm.from_kilobots(bots, seed) if use_array_engine else None
+    if workers:
+        swarm = PartitionedSwarm.from_kilobots(bots, seed, workers)
+    active_set = ActiveSet() if use_active_set else None
+
+    def step():
+        if swarm:
+            swarm.update_bots(dt, shape, enable_trilateration=enable_trilateration)
+        else:
+            update_bots(bots, dt, shape, enable_trilateration=enable_trilateration, active_set=active_set)
+
+    step()
+    swarm_memory = tracemalloc.get_traced_memory()[0] // 1024
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(round(warmup_time / dt) - 1):
+        step()
+    warmup_seconds = time.perf_counter() - start
+
+    tick_times = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        step()
+        tick_times.append(time.perf_counter() - start)
+
+    # Phases are only separate in the object engine, and they update every bot, frozen or not
+    phases = {}
+    if not swarm:
+        phase_times = [phase_tick(bots, dt, shape, enable_trilateration) for _ in range(ticks)]
+        phases = {phase: statistics.median(times[phase] for times in phase_times) for phase in PHASES}
+
+    screen = pygame.Surface(SCREEN_SIZE)
+    views = swarm.bots if swarm else bots
+    draw_times = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        draw_bots(screen, views)
+        draw_times.append(time.perf_counter() - start)
+
+    if workers:
+        swarm.close()
+    peak_memory = _peak_memory()
+    return {
+        "size": size,
+        "bots": len(views),
+        "tick_time": statistics.median(tick_times),
+        "tick_time_mean": statistics.mean(tick_times),
+        "ticks_per_second": 1 / statistics.median(tick_times),
+        "warmup_seconds": warmup_seconds,
+        "phases": phases,
+        "draw_time": statistics.median(draw_times),
+        "peak_memory_kb": peak_memory,
+        "swarm_memory_kb": swarm_memory,
+    }
+
+
+def _peak_memory():
+    # Peak resident memory of this process in kB
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_memory //= 1024 # Bytes on macOS, kilobytes everywhere else
+    return peak_memory
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, **options):
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        # A new process per size, so memory and caches of a size do not carry over to the next. It is not a
+        # daemon, so the partitioned engine can start its workers in it.
+        with ProcessPoolExecutor(1, context) as executor:
+            result = executor.submit(benchmark_size, size, **options).result()
+        results.append(result)
+        phases = ", ".join(f"{phase} {seconds * 1000:.1f}" for phase, seconds in result["phases"].items())
+        print(f"{result['bots']:>6} bots: {result['ticks_per_second']:8.2f} ticks/s, tick {result['tick_time'] * 1000:.1f} ms"
+              f"{f' ({phases})' if phases else ''}, draw {result['draw_time'] * 1000:.1f} ms, "
+              f"peak {result['peak_memory_kb']} kB (swarm {result['swarm_memory_kb']} kB)", flush=True)
+    return {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+                    "cpus": os.cpu_count()},
+        "options": options,
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    # Timings that got slower than the baseline by more than threshold, as (size, metric, old, new)
+    baseline_results = {result["size"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = baseline_results.get(result["size"])
+        if old is None:
+            continue
+        metrics = [("tick_time", old["tick_time"], result["tick_time"]), ("draw_time", old["draw_time"], result["draw_time"])]
+        metrics += [(phase, old["phases"][phase], seconds) for phase, seconds in result["phases"].items() if phase in old["phases"]]
+        for metric, old_value, new_value in metrics:
+            if new_value > old_value * (1 + threshold) and new_value - old_value > MIN_REGRESSION_SECONDS:
+                regressions.append((result["size"], metric, old_value, new_value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure tick throughput, phase timings and memory for growing swarms")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma separated swarm sizes")
+    parser.add_argument("--shape", default=DEFAULT_IMAGE_FILE)
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS, help="Measured ticks per size")
+    parser.add_argument("--warmup-time", type=float, default=DEFAULT_WARMUP_TIME, help="Simulated seconds before measuring")
+    parser.add_argument("--dt", type=float, default=DEFAULT_DT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-trilateration", dest="enable_trilateration", action="store_false")
+    parser.add_argument("--least-squares", dest="enable_trilateration", action="store_const", const=LEAST_SQUARES)
+    parser.add_argument("--array-engine", action="store_true", help="Benchmark the NumPy swarm engine")
+    parser.add_argument("--workers", type=int, default=None, help="Benchmark the partitioned engine with this many processes")
+    parser.add_argument("--no-active-set", dest="use_active_set", action="store_false")
+    parser.add_argument("--output", default=None, help="JSON file the results are written to")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks([int(size) for size in args.sizes.split(",")], image_file=args.shape, ticks=args.ticks,
+                            warmup_time=args.warmup_time, dt=args.dt, seed=args.seed, enable_trilateration=args.enable_trilateration,
+                            use_array_engine=args.array_engine, use_active_set=args.use_active_set, workers=args.workers)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for size, metric, old, new in regressions:
+            print(f"REGRESSION {size} bots {metric}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms ({new / old - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
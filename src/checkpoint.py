@@ -0,0 +1,160 @@
+import os
+import gc
+import pickle
+import hashlib
+from math import inf
+import numpy as np
+import kilobot
+from atomic_file import atomic_write
+from kilobot import Kilobot, KilobotState, NeighbourRecord
+
+CHECKPOINT_VERSION = 4
+NEIGHBOUR_SLOTS = ("neighbours", "neighbours_by_state", "neighbour_pool") # Saved as a table, see _neighbour_table
+
+
+class _Pickler(pickle.Pickler):
+    # Kilobots are written once in a flat list and referenced by index everywhere else, so the neighbour
+    # records linking the bots to each other do not turn into one deep recursion through the whole swarm
+    def __init__(self, file, indices):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.indices = indices
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Kilobot):
+            if id(obj) not in self.indices:
+                # Pickled by value it would pull the whole swarm in through its neighbour records
+                raise ValueError(f"Kilobot {obj.id} is referenced by the checkpoint but is not one of its bots")
+            return self.indices[id(obj)]
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, bots):
+        super().__init__(file)
+        self.bots = bots
+
+    def persistent_load(self, index):
+        return self.bots[index]
+
+
+def _neighbour_table(bots, indices):
+    # The neighbour records of every bot as flat arrays, records of bots that are not in bots any more
+    # are left out. Unused pooled records are not saved, the pools grow again when needed.
+    state_values = {state: state.value for state in KilobotState}
+    rows = [(receiver, indices[id(record.bot)], record.distance, record.gradient, state_values[record.state], record.activation_index, *record.pos)
+            for receiver, bot in enumerate(bots) for record in bot.neighbours if id(record.bot) in indices]
+    columns = np.array(rows, dtype=float).reshape(-1, 8)
+    return {
+        "receivers": columns[:, 0].astype(np.int64),
+        "senders": columns[:, 1].astype(np.int64),
+        "distances": columns[:, 2],
+        "gradients": columns[:, 3],
+        "states": columns[:, 4].astype(np.int8),
+        "activation_indices": columns[:, 5],
+        "pos": columns[:, 6:8],
+    }
+
+
+def _restore_neighbours(bots, table):
+    for bot in bots:
+        bot.neighbours = []
+        bot.neighbours_by_state = [[] for _ in KilobotState]
+        bot.neighbour_pool = []
+    states = list(KilobotState)
+    # Hundreds of thousands of records are created, collecting in between would only walk over them
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for receiver, sender, distance, gradient, state, activation_index, pos in zip(
+                table["receivers"].tolist(), table["senders"].tolist(), table["distances"].tolist(), table["gradients"].tolist(),
+                table["states"].tolist(), table["activation_indices"].tolist(), map(tuple, table["pos"].tolist())):
+            record = NeighbourRecord()
+            record.bot = bots[sender]
+            record.id = record.bot.id
+            record.distance = distance
+            record.gradient = int(gradient) if gradient != inf else inf
+            record.state = states[state]
+            record.activation_index = int(activation_index) if activation_index != inf else inf
+            record.pos = pos
+            bot = bots[receiver]
+            bot.neighbours.append(record)
+            bot.neighbours_by_state[state].append(record)
+            bot.neighbour_pool.append(record)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def shape_hash(image_file):
+    with open(image_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def save_checkpoint(path, timer, image_file, bots, swarm=None, gradient_field=None, active_set=None, metrics=None, settings=None):
+    # Saves everything needed to continue the simulation: the bots or the array swarm, the incremental
+    # gradient and active set, the metrics so far, the class counters, the noise streams and the shape
+    kilobots = [bot for bot in bots if isinstance(bot, Kilobot)]
+    indices = {id(bot): i for i, bot in enumerate(kilobots)}
+    header = {
+        "version": CHECKPOINT_VERSION,
+        "kilobots": len(kilobots),
+        "timer": timer,
+        "image_file": image_file,
+        "shape_hash": shape_hash(image_file),
+        "settings": dict(settings or {}),
+    }
+    state = {
+        "bot_slots": [{name: getattr(bot, name) for name in Kilobot.__slots__ if hasattr(bot, name) and name not in NEIGHBOUR_SLOTS}
+                      for bot in kilobots],
+        "neighbours": _neighbour_table(kilobots, indices),
+        "bots": bots,
+        "swarm": swarm,
+        "gradient_field": gradient_field,
+        "active_set": active_set,
+        "metrics": metrics,
+        "next_id": Kilobot.next_id,
+        "next_activation_index": Kilobot.next_activation_index,
+        "noise": Kilobot.noise,
+        "constants": {name: value for name, value in vars(kilobot).items() if name.isupper()},
+    }
+
+    with atomic_write(path) as f:
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        _Pickler(f, indices).dump(state)
+
+
+def load_checkpoint(path, restore_constants=False):
+    # Returns the saved simulation as a dict and restores the class counters and the noise streams.
+    # The kilobot.py constants the checkpoint was saved with are only restored if asked for.
+    with open(path, "rb") as f:
+        header = pickle.load(f)
+        if header["version"] != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {header['version']}")
+        kilobots = [Kilobot.__new__(Kilobot) for _ in range(header["kilobots"])]
+        state = _Unpickler(f, kilobots).load()
+
+    if os.path.exists(header["image_file"]) and shape_hash(header["image_file"]) != header["shape_hash"]:
+        raise ValueError(f"Shape {header['image_file']} changed since the checkpoint was saved")
+
+    for bot, slots in zip(kilobots, state.pop("bot_slots")):
+        for name, value in slots.items():
+            setattr(bot, name, value)
+    _restore_neighbours(kilobots, state.pop("neighbours"))
+    Kilobot.next_id = state["next_id"]
+    Kilobot.next_activation_index = state["next_activation_index"]
+    Kilobot.noise = state["noise"]
+    if restore_constants:
+        for name, value in state["constants"].items():
+            setattr(kilobot, name, value)
+
+    state.update(header)
+    return state
+
+
+def fork_checkpoint(path, variants, restore_constants=False):
+    # Independent copies of one checkpoint, each with its settings updated by one of the variants,
+    # e.g. fork_checkpoint(path, [{"enable_trilateration": True}, {"enable_trilateration": False}])
+    for variant in variants:
+        checkpoint = load_checkpoint(path, restore_constants)
+        checkpoint["settings"].update(variant)
+        yield checkpoint
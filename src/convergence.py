@@ -0,0 +1,88 @@
+import numpy as np
+import kilobot
+from kilobot import KilobotState, MOVING_STATES
+from array_swarm import ArraySwarm
+
+JOIN_TIMEOUT = 300 # Simulated seconds without a new joined bot after which the run has stalled
+SETTLE_TIME = 10 # Simulated seconds without moving bots, after the first one moved, after which the run has settled
+FILL_TARGET = None # Fill ratio of the shape at which the run is complete once no bot moves, None to never stop on it
+IDLE_DT_FACTOR = 10 # dt is this many times wider while no bot moves or localises after joining
+
+FILLED = "filled"
+SETTLED = "settled"
+STALLED = "stalled"
+
+
+class ConvergenceMonitor:
+    # Watches the swarm after every update and tells when the assembly is over: no bot moved for
+    # SETTLE_TIME, no bot joined for JOIN_TIMEOUT or, with a fill_target, the joined bots fill that much of
+    # the shape and no bot moves. The capacity of the shape is only estimated from its area, and bots go
+    # on joining past it, so there is no fill_target by default. While no bot moves, e.g. in the startup
+    # phase, step_dt widens the timestep, as the bots then only count time or wait for each other.
+    def __init__(self, shape, start_time=0, join_timeout=JOIN_TIMEOUT, settle_time=SETTLE_TIME, fill_target=FILL_TARGET,
+                 idle_dt_factor=IDLE_DT_FACTOR):
+        self.join_timeout = join_timeout
+        self.settle_time = settle_time
+        self.fill_target = fill_target
+        self.idle_dt_factor = idle_dt_factor
+        # Bots that fill the shape, hexagonally packed at DESIRED_DISTANCE
+        self.capacity = shape.area / (3 ** 0.5 / 2 * kilobot.DESIRED_DISTANCE ** 2)
+        self.joined = None
+        self.last_join = start_time
+        self.last_moving = None # Time a bot was last seen moving, None until the first one moves
+        self.moving = 0
+        self.localising = 0
+        self.reason = None
+
+    def update(self, timer, bots, swarm=None):
+        # Called after every update, returns FILLED, SETTLED or STALLED once the run converged, else None
+        counts = state_counts(bots, swarm)
+        self.moving = sum(counts[state] for state in MOVING_STATES)
+        self.localising = counts["localising"]
+        joined = counts[KilobotState.JOINED_SHAPE.value]
+        if joined != self.joined:
+            self.joined = joined
+            self.last_join = timer
+        if self.moving:
+            self.last_moving = timer
+
+        if self.fill_target is not None and self.moving == 0 and self.fill_ratio() >= self.fill_target:
+            self.reason = FILLED
+        elif self.moving == 0 and self.last_moving is not None and timer - self.last_moving >= self.settle_time:
+            self.reason = SETTLED
+        elif timer - self.last_join >= self.join_timeout:
+            self.reason = STALLED
+        else:
+            self.reason = None
+        return self.reason
+
+    def step_dt(self, dt):
+        # dt of the next update, wider while nothing moves
+        if self.moving == 0 and self.localising == 0:
+            return dt * self.idle_dt_factor
+        return dt
+
+    def fill_ratio(self):
+        return (self.joined or 0) / self.capacity
+
+    def text(self):
+        if self.reason:
+            return f"Converged: {self.reason}"
+        return f"Fill ratio: {self.fill_ratio():.2f}"
+
+
+def state_counts(bots, swarm=None):
+    # Bots per state value, and the joined bots that still localise, from the arrays of an ArraySwarm
+    if isinstance(swarm, ArraySwarm):
+        counts = np.bincount(swarm.state, minlength=len(KilobotState)).tolist()
+        joined = swarm.state == KilobotState.JOINED_SHAPE.value
+        return {**dict(enumerate(counts)), "localising": int(np.count_nonzero(joined & swarm.use_localise & ~swarm.is_seed))}
+
+    counts = dict.fromkeys(range(len(KilobotState)), 0)
+    localising = 0
+    for bot in bots:
+        counts[bot.state.value] += 1
+        if bot.state == KilobotState.JOINED_SHAPE and bot.use_localise and not bot.is_seed:
+            localising += 1
+    counts["localising"] = localising
+    return counts
@@ -0,0 +1,223 @@
+import heapq
+from math import floor, inf
+import kilobot
+from kilobot import Kilobot, KilobotState, NeighbourRecord, MOVING_STATES, LEAST_SQUARES, neighbour_cell_size, localise_least_squares
+from spatial_hash import SpatialHash
+
+CLOCK_SKEW = 0.05 # Largest relative error of the clock rate of a bot, fixed for each bot
+CLOCK_JITTER = 0.1 # Largest random change of each message period, relative to the period
+NEIGHBOUR_TIMEOUT = 2.5 # Message periods after which a record is forgotten if its sender or receiver moves
+NOISE_BLOCK = 4096 # Noise values drawn at once
+
+MESSAGE = 0 # A bot broadcasts and its neighbours receive the message
+STEP = 1 # A bot runs its program, a moving bot also makes one movement step
+
+
+class EventEngine:
+    # Discrete-event simulation of Kilobots with their own clocks. Every bot broadcasts and steps with its
+    # own period, off by up to CLOCK_SKEW, starting at a random phase, and every message period jitters by
+    # up to CLOCK_JITTER, so the bots are never in lock-step. Bots keep the last message of each neighbour.
+    # Bots that wait for something to happen (starting, waiting to move, joined) sleep until a message
+    # changes what they know, the startup time ends or a moving neighbour is not heard again, so
+    # simulated time is only spent on the bots where something happens. Sleeping bots only receive the
+    # messages whose content changed or whose sender moves.
+    # Used in place of an ArraySwarm: update_bots advances the simulated time by dt.
+    def __init__(self, bots, dt, start_time=0, clock_skew=CLOCK_SKEW, clock_jitter=CLOCK_JITTER):
+        self.bots = bots
+        self.dt = dt
+        self.time = start_time
+        self.clock_jitter = clock_jitter
+        self.events = [] # Heap of (time, sequence, kind, bot)
+        self.sequence = 0 # Orders the events of the same time by when they were scheduled
+        self.spatial_hash = SpatialHash(neighbour_cell_size()) # Every bot
+        self.awake_hash = SpatialHash(neighbour_cell_size()) # Bots that are not sleeping
+        self.inboxes = {} # bot -> {sender: NeighbourRecord of its last message}
+        self.periods = {}
+        self.phases = {} # bot -> time of one of its clock ticks
+        self.last_steps = {}
+        self.next_steps = {} # bot -> time of its next STEP, later STEP events of the bot are stale
+        self.sent = {} # bot -> content of its last message
+        self.awake = set()
+        self.streams = {} # Noise iterators by stream, see _noise
+        self.remaining = dict.fromkeys(("distance", "forward", "rotation", "clock"), 0) # Noise values left in them
+        self.counts = dict.fromkeys(("messages", "deliveries", "steps"), 0)
+
+        skews = Kilobot.noise.draw("clock", len(bots), clock_skew).tolist()
+        phases = Kilobot.noise.draw("clock", 2 * len(bots), 0.5).tolist()
+        for bot, skew, step_phase, message_phase in zip(bots, skews, phases[::2], phases[1::2]):
+            period = dt * (1 + skew)
+            self.periods[bot] = period
+            self.phases[bot] = start_time + (step_phase + 0.5) * period
+            self.last_steps[bot] = start_time
+            self.inboxes[bot] = {}
+            self.spatial_hash.insert(bot)
+            self._wake(bot, start_time)
+            self._push(start_time + (message_phase + 0.5) * period, MESSAGE, bot)
+
+    def update_bots(self, dt, shape, enable_trilateration=False, profiler=None):
+        # Processes the events of the next dt simulated seconds. enable_trilateration is one of LOCALISATION_MODES.
+        Kilobot.spatial_hash = self.spatial_hash # Used for the collisions of the moving bots
+        Kilobot.frozen_hash = None
+        counts = dict(self.counts)
+        end = self.time + dt
+        events = self.events
+        while events and events[0][0] <= end:
+            time, _, kind, bot = heapq.heappop(events)
+            if kind == MESSAGE:
+                self._broadcast(bot, time)
+                jitter = next(self._noise("clock", 1, self.clock_jitter))
+                self._push(time + self.periods[bot] * (1 + jitter), MESSAGE, bot)
+            elif self.next_steps.get(bot) == time:
+                del self.next_steps[bot]
+                self._step(bot, time, shape, enable_trilateration)
+        self.time = end
+
+        if profiler is not None:
+            for name, count in self.counts.items():
+                profiler.count(name, count - counts[name], "events")
+            profiler.count("awake", len(self.awake), "events")
+            profiler.count_tick(self.bots, self.counts["deliveries"] - counts["deliveries"], 0)
+
+    def remove_bots_not_forming_shape(self):
+        # Same as kilobot.remove_bots_not_forming_shape, the engine keeps no reference to the removed bots
+        self.bots = kilobot.remove_bots_not_forming_shape(self.bots)
+        kept = set(self.bots)
+        for bot in [bot for bot in self.inboxes if bot not in kept]:
+            del self.inboxes[bot]
+            self.spatial_hash.remove(bot)
+            if bot in self.awake:
+                self.awake.discard(bot)
+                self.awake_hash.remove(bot)
+            for bot_dict in (self.periods, self.phases, self.last_steps, self.next_steps, self.sent):
+                bot_dict.pop(bot, None)
+        for inbox in self.inboxes.values():
+            for sender in [sender for sender in inbox if sender not in kept]:
+                del inbox[sender]
+        self.events = [event for event in self.events if event[3] in kept]
+        heapq.heapify(self.events)
+
+    def _broadcast(self, sender, time):
+        self.counts["messages"] += 1
+        content = (sender.state, sender.gradient, sender.percieved_pos, sender.activation_index)
+        changed = content != self.sent.get(sender)
+        self.sent[sender] = content
+        # A stationary sender that repeats itself is only heard by the bots that are awake
+        hash = self.spatial_hash if changed or sender.state.value in MOVING_STATES else self.awake_hash
+        receivers = hash.query(sender.pos)
+        errors = self._noise("distance", len(receivers), kilobot.DISTANCE_ERROR)
+        for receiver, error in zip(receivers, errors):
+            if receiver is sender:
+                continue
+            distance = sender._real_distance_to(receiver.pos)
+            if not kilobot.DISABLE_DISTANCE_ERROR:
+                distance += error * distance
+            if distance > kilobot.BROADCAST_RADIUS:
+                # A bot that misses a changed message forgets the sender instead of keeping what it said before
+                if changed and self.inboxes[receiver].pop(sender, None) is not None and receiver not in self.awake:
+                    self._wake(receiver, time)
+                continue
+
+            self.counts["deliveries"] += 1
+            inbox = self.inboxes[receiver]
+            record = inbox.get(sender)
+            if record is None:
+                record = inbox[sender] = NeighbourRecord()
+                record.id = sender.id
+                record.bot = sender
+                wakes = True
+            else:
+                wakes = record.state is not sender.state or record.gradient != sender.gradient
+            record.distance = distance
+            record.gradient = sender.gradient
+            record.state = sender.state
+            record.activation_index = sender.activation_index
+            record.pos = sender.percieved_pos
+            record.time = time
+            if wakes and receiver not in self.awake:
+                self._wake(receiver, time)
+
+    def _step(self, bot, time, shape, enable_trilateration):
+        self.counts["steps"] += 1
+        if bot not in self.awake: # Woken by its own timeout
+            self.awake.add(bot)
+            self.awake_hash.insert(bot)
+        elapsed = time - self.last_steps[bot]
+        self.last_steps[bot] = time
+
+        # The records of moving senders, and every record of a moving bot, are dropped when they get old
+        bot.clear_neighbours()
+        moving = bot.state.value in MOVING_STATES
+        timeout = time - NEIGHBOUR_TIMEOUT * self.dt
+        oldest_moving = inf
+        inbox = self.inboxes[bot]
+        for sender, record in list(inbox.items()):
+            sender_moving = record.state.value in MOVING_STATES
+            if sender_moving or moving:
+                if record.time < timeout:
+                    del inbox[sender]
+                    continue
+                if sender_moving and record.time < oldest_moving:
+                    oldest_moving = record.time
+            bot.neighbours.append(record)
+            bot.neighbours_by_state[record.state.value].append(record)
+
+        bot.form_gradient()
+        if enable_trilateration == LEAST_SQUARES:
+            localise_least_squares([bot])
+        elif enable_trilateration:
+            bot.localise()
+        else:
+            bot.perfect_localise()
+        old_pos = bot.pos
+        Kilobot.noise.forward = self._noise("forward", 1, kilobot.KILOBOT_FORWARD_SPEED_ERROR)
+        Kilobot.noise.rotation = self._noise("rotation", 1, kilobot.KILOBOT_ROTATION_SPEED_ERROR)
+        bot.self_assembly(elapsed, shape)
+        bot.update_color()
+        if bot.pos != old_pos:
+            self.spatial_hash.move(bot, old_pos)
+            self.awake_hash.move(bot, old_pos)
+
+        state = bot.state
+        if state.value in MOVING_STATES or (state == KilobotState.JOINED_SHAPE and bot.use_localise and not bot.is_seed):
+            self._schedule_step(bot, time + self.periods[bot])
+            return
+
+        # Sleeps until woken by a message, or until the startup time ends or a moving neighbour may have left
+        self.awake.discard(bot)
+        self.awake_hash.remove(bot)
+        wake = inf
+        if state == KilobotState.START and not bot.is_seed:
+            wake = time + kilobot.STARTUP_TIME - bot.timer
+        elif state == KilobotState.WAIT_TO_MOVE and oldest_moving < inf:
+            wake = oldest_moving + NEIGHBOUR_TIMEOUT * self.dt
+        if wake < inf:
+            self._schedule_step(bot, self._clock_tick(bot, wake))
+
+    def _wake(self, bot, time):
+        self.awake.add(bot)
+        self.awake_hash.insert(bot)
+        self._schedule_step(bot, self._clock_tick(bot, time))
+
+    def _schedule_step(self, bot, time):
+        if self.next_steps.get(bot, inf) <= time:
+            return
+        self.next_steps[bot] = time
+        self._push(time, STEP, bot)
+
+    def _clock_tick(self, bot, time):
+        # First tick of the clock of the bot after time
+        period = self.periods[bot]
+        phase = self.phases[bot]
+        return phase + (floor((time - phase) / period) + 1) * period
+
+    def _push(self, time, kind, bot):
+        heapq.heappush(self.events, (time, self.sequence, kind, bot))
+        self.sequence += 1
+
+    def _noise(self, name, size, error):
+        # Iterator over the next size errors, taken from blocks of NOISE_BLOCK errors
+        if self.remaining[name] < size:
+            self.remaining[name] = max(size, NOISE_BLOCK)
+            self.streams[name] = Kilobot.noise.errors(name, self.remaining[name], error)
+        self.remaining[name] -= size
+        return self.streams[name]
@@ -0,0 +1,57 @@
+from math import inf
+from time import perf_counter
+
+TIME_WARPS = (1, 10, 100, inf) # Simulated seconds per real second, inf runs as many steps as fit in a frame
+RATE_INTERVAL = 0.5 # Real seconds between updates of the measured steps per second
+
+
+class FixedTimestep:
+    # Runs fixed dt simulation steps at time_warp times real time, never using more than frame_budget
+    # real seconds per frame. A frame always runs at least one step when one is due, and the backlog is
+    # dropped when the simulation can not keep up.
+    def __init__(self, dt, frame_budget, time_warp=1):
+        self.dt = dt
+        self.frame_budget = frame_budget
+        self.time_warp = time_warp
+        self.accumulator = 0
+        self.frame_start = 0
+        self.frame_steps = 0
+        self.steps_per_second = 0
+        self.counted_steps = 0
+        self.count_start = perf_counter()
+
+    def next_time_warp(self):
+        self.time_warp = TIME_WARPS[(TIME_WARPS.index(self.time_warp) + 1) % len(TIME_WARPS)]
+        self.accumulator = 0
+
+    def start_frame(self, elapsed):
+        # elapsed is the real time since the last frame, in seconds
+        self.frame_start = perf_counter()
+        self.frame_steps = 0
+        if self.time_warp == inf:
+            self.accumulator = inf
+        else:
+            self.accumulator += elapsed * self.time_warp
+
+    def next_step(self):
+        # True while another step should run in this frame
+        if self.accumulator < self.dt:
+            return False
+        if self.frame_steps > 0 and perf_counter() - self.frame_start > self.frame_budget:
+            self.accumulator = min(self.accumulator, self.dt)
+            return False
+        self.accumulator -= self.dt
+        self.frame_steps += 1
+        self.counted_steps += 1
+        return True
+
+    def update_rate(self):
+        now = perf_counter()
+        if now - self.count_start >= RATE_INTERVAL:
+            self.steps_per_second = self.counted_steps / (now - self.count_start)
+            self.counted_steps = 0
+            self.count_start = now
+        return self.steps_per_second
+
+    def time_warp_text(self):
+        return "max" if self.time_warp == inf else f"{self.time_warp}x"
@@ -0,0 +1,132 @@
+from math import inf
+import kilobot
+from kilobot import KilobotState
+
+STATIONARY = (KilobotState.WAIT_TO_MOVE, KilobotState.JOINED_SHAPE)
+
+
+class GradientField:
+    # Gradients of the stationary bots over the graph of stationary bots that hear each other within
+    # GRADIENT_DISTANCE. Seeds and bots that stopped updating their gradient are the sources. Like
+    # form_gradient, every tick a bot takes the lowest gradient its stationary neighbours had in the
+    # last tick plus one, so a change travels one hop per tick. Only the bots whose neighbours or
+    # in-edges changed in the last tick are recomputed, the others would get the same gradient again.
+    # The edges of the pairs whose distance error can put them on either side of GRADIENT_DISTANCE are
+    # tested again against the records of every tick, as form_gradient does.
+    def __init__(self):
+        self.nodes = {} # id -> stationary bot
+        self.sources = {} # id -> fixed gradient
+        self.gradients = {} # id -> gradient in the last tick
+        self.in_edges = {} # id -> ids of the stationary bots it hears within GRADIENT_DISTANCE
+        self.out_edges = {} # id -> ids of the stationary bots that hear it within GRADIENT_DISTANCE
+        self.dirty = set() # ids to recompute in the next tick
+        self.uncertain = {} # id -> ids of the bots it may or may not hear within GRADIENT_DISTANCE in a tick
+
+    def update(self, bots):
+        # Called once per tick after update_neighbours. Sets the gradient of every stationary bot that
+        # still updates it, the caller must skip form_gradient for the bots in self.nodes.
+        stationary = {}
+        sources = {}
+        for bot in bots:
+            if bot.state in STATIONARY:
+                stationary[bot.id] = bot
+                if bot.is_seed:
+                    sources[bot.id] = 0
+                elif not bot.updates_gradient:
+                    sources[bot.id] = bot.gradient
+
+        dirty = self.dirty
+        for id in [id for id in self.nodes if id not in stationary]:
+            dirty.update(self.out_edges[id])
+            self._remove_node(id)
+        added = [stationary[id] for id in stationary if id not in self.nodes]
+        for bot in added:
+            self._add_node(bot)
+        for bot in added:
+            dirty.add(bot.id)
+            dirty.update(self.out_edges[bot.id])
+        dirty.update(id for id in stationary if self.sources.get(id) != sources.get(id))
+        self.sources = sources
+        for id, parents in self.uncertain.items():
+            if id not in sources:
+                for parent in parents:
+                    heard = self._hears(id, parent)
+                    if heard != (parent in self.in_edges[id]):
+                        self._set_edge(parent, id, heard)
+                        dirty.add(id)
+        dirty.intersection_update(self.nodes)
+        if not dirty:
+            return
+
+        # Every bot reads the gradients of the last tick, so they are all computed before any is set
+        gradients = self.gradients
+        new_gradients = {}
+        for id in dirty:
+            if id in sources:
+                new_gradients[id] = sources[id]
+            else:
+                new_gradients[id] = min((gradients[parent] for parent in self.in_edges[id]), default=inf) + 1
+        self.dirty = set()
+        for id, gradient in new_gradients.items():
+            if gradient != gradients[id]:
+                gradients[id] = gradient
+                self.dirty.update(self.out_edges[id])
+            bot = self.nodes[id]
+            if bot.updates_gradient and not bot.is_seed:
+                bot.gradient = gradient
+
+    def prune(self, bots):
+        # Drops the bots that are not in bots any more, as the next update would
+        kept = {bot.id for bot in bots}
+        for id in [id for id in self.nodes if id not in kept]:
+            self.dirty.update(self.out_edges[id])
+            self._remove_node(id)
+            self.sources.pop(id, None)
+        self.dirty.intersection_update(self.nodes)
+
+    def _add_node(self, bot):
+        self.nodes[bot.id] = bot
+        self.gradients[bot.id] = bot.gradient
+        self.in_edges[bot.id] = set()
+        self.out_edges[bot.id] = set()
+        error = 0 if kilobot.DISABLE_DISTANCE_ERROR else kilobot.DISTANCE_ERROR
+        nearest = kilobot.GRADIENT_DISTANCE / (1 + error) # Closer pairs always hear each other within GRADIENT_DISTANCE
+        farthest = kilobot.GRADIENT_DISTANCE / (1 - error) if error < 1 else inf # Farther pairs never do
+        for state in STATIONARY:
+            for neighbour in bot.neighbours_by_state[state.value]:
+                if neighbour.id not in self.nodes:
+                    continue
+                self._set_edge(neighbour.id, bot.id, neighbour.distance < kilobot.GRADIENT_DISTANCE)
+                # Whether the neighbour hears this bot is in the neighbour's own records
+                self._set_edge(bot.id, neighbour.id, self._hears(neighbour.id, bot.id))
+                if nearest <= bot._real_distance_to(neighbour.bot.pos) < farthest:
+                    self.uncertain.setdefault(bot.id, set()).add(neighbour.id)
+                    self.uncertain.setdefault(neighbour.id, set()).add(bot.id)
+
+    def _remove_node(self, id):
+        for parent in self.in_edges.pop(id):
+            self.out_edges[parent].discard(id)
+        for child in self.out_edges.pop(id):
+            self.in_edges[child].discard(id)
+        for other in self.uncertain.pop(id, ()):
+            self.uncertain[other].discard(id)
+            if not self.uncertain[other]:
+                del self.uncertain[other]
+        del self.nodes[id]
+        del self.gradients[id]
+
+    def _hears(self, id, parent):
+        # Whether the bot heard parent within GRADIENT_DISTANCE in this tick
+        bot, parent_bot = self.nodes[id], self.nodes[parent]
+        for record in bot.neighbours_by_state[parent_bot.state.value]:
+            if record.bot is parent_bot:
+                return record.distance < kilobot.GRADIENT_DISTANCE
+        return False
+
+    def _set_edge(self, parent, id, heard):
+        if heard:
+            self.in_edges[id].add(parent)
+            self.out_edges[parent].add(id)
+        else:
+            self.in_edges[id].discard(parent)
+            self.out_edges[parent].discard(id)
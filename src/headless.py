@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import sys
+from math import ceil
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+from noise import Noise
+from kilobot import Kilobot, KilobotState, update_bots, generate_kilobots, average_location_error, LEAST_SQUARES
+from array_swarm import ArraySwarm
+from partitioned import PartitionedSwarm
+from event_engine import EventEngine
+from shape_mask import load_compiled_shape
+from convergence import ConvergenceMonitor
+from gradient_field import GradientField
+from active_set import ActiveSet
+from results import ResultsStore
+from metrics import MetricsSink
+from trajectory import TrajectoryRecorder
+from checkpoint import save_checkpoint, load_checkpoint
+from profiler import PhaseProfiler
+
+DEFAULT_IMAGE_FILE = "shapes/arrow.png"
+DEFAULT_DT = 0.1
+DEFAULT_MAX_TIME = 600
+RESUMED_SETTINGS = ("enable_trilateration", "dt") # Saved in the checkpoint settings, a resumed run keeps them unless given
+TICK_TOLERANCE = 1e-6 # Fraction of a tick by which a time can miss a multiple of dt and still count as on it
+
+
+def run_headless(image_file=DEFAULT_IMAGE_FILE, rows=10, cols=20, enable_trilateration=None, dt=None,
+                 max_time=DEFAULT_MAX_TIME, use_array_engine=False, seed=None, incremental_gradient=False,
+                 use_active_set=True, record=None, resume=None, checkpoint=None, checkpoint_time=None, profile=None, workers=None,
+                 event_driven=False, converge=False):
+    # Runs one simulation with no display and no frame cap and returns its metrics. With record the bots of
+    # every tick are written to that trajectory directory, which main.py --replay plays back.
+    # resume is a checkpoint file or a loaded checkpoint to continue from, then the shape, the bots and the
+    # engine options are the checkpoint's, enable_trilateration and dt default to its settings and seed, if
+    # given, reseeds the restored noise. Otherwise they default to trilateration and DEFAULT_DT.
+    # checkpoint is a file the simulation is saved to once it reaches checkpoint_time, or at the end.
+    # profile is a file the trace of the update phases is exported to, see profiler.py.
+    # workers runs the swarm in that many processes with the partitioned engine, see partitioned.py.
+    # incremental_gradient and use_active_set only apply to the object engine, the other engines ignore them.
+    # event_driven runs the bots with asynchronous clocks, see event_engine.py.
+    # converge ends the run before max_time once it converged and widens dt while no bot moves, see convergence.py.
+    if incremental_gradient and (workers or use_array_engine or event_driven):
+        raise ValueError("The incremental gradient is only used by the object engine")
+    if resume is not None:
+        if isinstance(resume, str):
+            resume = load_checkpoint(resume)
+        image_file = resume["image_file"]
+        bots, swarm = resume["bots"], resume["swarm"]
+        gradient_field, active_set = resume["gradient_field"], resume["active_set"]
+        timer, metrics = resume["timer"], resume["metrics"]
+        settings = resume["settings"]
+        if enable_trilateration is None:
+            enable_trilateration = settings.get("enable_trilateration")
+        if dt is None:
+            dt = settings.get("dt")
+        if seed is not None:
+            Kilobot.noise = Noise(seed)
+            if isinstance(swarm, ArraySwarm):
+                swarm.noise = Noise(seed)
+    else:
+        Kilobot.noise = Noise(seed)
+        Kilobot.next_id = 0
+        Kilobot.next_activation_index = 0
+    if enable_trilateration is None:
+        enable_trilateration = True
+    if dt is None:
+        dt = DEFAULT_DT
+    settings = {"enable_trilateration": enable_trilateration, "dt": dt} # Saved with the checkpoint, see RESUMED_SETTINGS
+
+    compiled_shape = load_compiled_shape(image_file)
+    if not compiled_shape.origin:
+        raise ValueError(f"Shape origin not found in {image_file}")
+
+    if resume is None:
+        bots = generate_kilobots(compiled_shape.origin, rows, cols)
+        swarm = None
+        gradient_field = None
+        active_set = None
+        if workers:
+            swarm = PartitionedSwarm.from_kilobots(bots, seed, workers)
+            bots = swarm.bots
+        elif use_array_engine:
+            swarm = ArraySwarm.from_kilobots(bots, seed)
+            bots = swarm.bots
+        elif event_driven:
+            swarm = EventEngine(bots, dt)
+        else:
+            gradient_field = GradientField() if incremental_gradient else None
+            active_set = ActiveSet() if use_active_set else None
+        timer = 0
+        metrics = MetricsSink()
+
+    # Whole ticks of dt, so the float timer does not add a tick by falling just short of max_time
+    start_time = timer
+    ticks = tick_count(start_time, max_time, dt)
+    recorder = None
+    if record:
+        recorder = TrajectoryRecorder(record, bots, ticks + 1, image_file=image_file, dt=dt, seed=seed)
+        recorder.record(bots, timer)
+    profiler = PhaseProfiler(window=None) if profile else None
+    monitor = ConvergenceMonitor(compiled_shape, timer) if converge else None
+    if checkpoint and checkpoint_time is None:
+        checkpoint_time = max_time
+    checkpoint_tick = tick_count(start_time, checkpoint_time, dt) if checkpoint else None
+    tick = 0
+    while tick < ticks:
+        if checkpoint and tick >= checkpoint_tick:
+            save_checkpoint(checkpoint, timer, image_file, bots, swarm, gradient_field, active_set, metrics, settings)
+            checkpoint = None
+        step_ticks = min(round(monitor.step_dt(dt) / dt) if monitor else 1, ticks - tick)
+        step = step_ticks * dt
+        tick += step_ticks
+        timer = start_time + tick * dt
+        if swarm:
+            swarm.update_bots(step, compiled_shape, enable_trilateration=enable_trilateration, profiler=profiler)
+        else:
+            update_bots(bots, step, compiled_shape, enable_trilateration=enable_trilateration, gradient_field=gradient_field,
+                        active_set=active_set, profiler=profiler)
+        metrics.record_joins(bots, timer, swarm)
+        if isinstance(swarm, ArraySwarm) and recorder:
+            recorder.record_swarm(swarm, timer)
+        elif recorder:
+            recorder.record(bots, timer)
+        if monitor and monitor.update(timer, bots, swarm):
+            break
+
+    if recorder:
+        recorder.close()
+    if isinstance(swarm, PartitionedSwarm):
+        swarm.close()
+    if profiler:
+        profiler.export_trace(profile)
+        for text in profiler.texts():
+            print(text, file=sys.stderr)
+    if checkpoint:
+        save_checkpoint(checkpoint, timer, image_file, bots, swarm, gradient_field, active_set, metrics, settings)
+
+    forming_shape_bots = [bot for bot in bots if bot.state == KilobotState.JOINED_SHAPE]
+    return {
+        "errors": metrics.location_errors.values.tolist(),
+        "join_times": metrics.join_times.values.tolist(),
+        "time": metrics.last_join_time,
+        "bots": len(forming_shape_bots),
+        "average_error": average_location_error(forming_shape_bots),
+        "simulated_time": timer,
+        "converged": monitor.reason if monitor else None,
+    }
+
+
+def tick_count(start_time, end_time, dt):
+    # Ticks of dt from start_time until end_time is reached
+    return max(ceil((end_time - start_time) / dt - TICK_TOLERANCE), 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a kilobot simulation without display")
+    parser.add_argument("--shape", default=DEFAULT_IMAGE_FILE, help="Shape image, the red pixel marks the seed position")
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--trilateration", dest="enable_trilateration", action="store_const", const=True, default=None,
+                        help="Localise by trilateration, the default unless the resumed checkpoint says otherwise")
+    parser.add_argument("--no-trilateration", dest="enable_trilateration", action="store_false", help="Use perfect localisation")
+    parser.add_argument("--least-squares", dest="enable_trilateration", action="store_const", const=LEAST_SQUARES,
+                        help="Localise every bot at once with a batched least squares solve")
+    parser.add_argument("--dt", type=float, default=None, help=f"Simulated seconds per update, defaults to {DEFAULT_DT} or that of the resumed checkpoint")
+    parser.add_argument("--max-time", type=float, default=DEFAULT_MAX_TIME, help="Simulated seconds to run")
+    parser.add_argument("--array-engine", action="store_true", help="Use the NumPy swarm engine")
+    parser.add_argument("--workers", type=int, default=None, help="Split the arena between this many processes, see partitioned.py")
+    parser.add_argument("--event-driven", action="store_true", help="Run the bots with asynchronous clocks, see event_engine.py")
+    parser.add_argument("--converge", action="store_true", help="Stop once the shape is formed or no bot joins any more, see convergence.py")
+    parser.add_argument("--incremental-gradient", action="store_true", help="Recompute the gradients of the stationary bots only when their neighbours change")
+    parser.add_argument("--no-active-set", dest="use_active_set", action="store_false", help="Update frozen bots every tick too")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--record", default=None, metavar="DIR", help="Record the trajectory of the run for main.py --replay")
+    parser.add_argument("--checkpoint", default=None, metavar="FILE", help="Save the simulation to this file to resume it later")
+    parser.add_argument("--checkpoint-time", type=float, default=None, help="Simulated seconds at which the checkpoint is saved, defaults to the end")
+    parser.add_argument("--resume", default=None, metavar="FILE",
+                        help="Continue the simulation saved in this checkpoint, up to --max-time, with its localisation and dt unless given")
+    parser.add_argument("--profile", default=None, metavar="FILE", help="Time the update phases and export their trace to this file")
+    parser.add_argument("--output", default=None, help="JSON Lines results file the run is appended to, printed if not given")
+    parser.add_argument("--columnar", action="store_true", help="Store the error series of the run in a .npz file")
+    parser.add_argument("--test-name", default=None, help="Name of the run in the results file, defaults to the shape name")
+    args = parser.parse_args(argv)
+    engines = [name for name, used in (("--array-engine", args.array_engine), ("--workers", args.workers),
+                                       ("--event-driven", args.event_driven)) if used]
+    if engines and args.incremental_gradient:
+        parser.error(f"--incremental-gradient only applies to the object engine, not {engines[0]}")
+    if engines and not args.use_active_set:
+        parser.error(f"--no-active-set only applies to the object engine, not {engines[0]}")
+
+    result = run_headless(args.shape, args.rows, args.cols, args.enable_trilateration, args.dt, args.max_time,
+                          args.array_engine, args.seed, args.incremental_gradient, args.use_active_set, args.record,
+                          args.resume, args.checkpoint, args.checkpoint_time, args.profile, args.workers,
+                          args.event_driven, args.converge)
+    if args.output:
+        result["test_name"] = args.test_name or os.path.splitext(os.path.basename(args.shape))[0]
+        ResultsStore(args.output).append(result, args.columnar)
+    else:
+        print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 from math import sin, cos, pi, inf
-from random import random, normalvariate
 from enum import Enum
-import pygame
+import numpy as np
+from spatial_hash import SpatialHash
+from noise import Noise
+from shape_mask import load_compiled_shape
 
 KILOBOT_FORWARD_SPEED_MEAN = 10
 KILOBOT_FORWARD_SPEED_STD = 1
@@ -24,6 +26,11 @@ DISABLE_DISTANCE_ERROR = False
 
 LOCALISE_TIME_AFTER_JOINING = 1
 
+LEAST_SQUARES = "least_squares" # enable_trilateration value that localises every bot at once, see least_squares_localise
+LOCALISATION_MODES = (True, LEAST_SQUARES, False) # [T] cycles through them, False is perfect localisation
+LEAST_SQUARES_ITERATIONS = 3 # Gauss-Newton steps per tick, each tick starts from the estimate of the last one
+LEAST_SQUARES_DAMPING = 0.01 # Fraction of the curvature added to it, keeps the steps of collinear neighbours bounded
+
 class KilobotState(Enum):
     START = 0
     WAIT_TO_MOVE = 1
@@ -32,17 +39,37 @@ class KilobotState(Enum):
     JOINED_SHAPE = 4
 
 
+# State values, used to index Kilobot.neighbours_by_state
+MOVING_STATES = (KilobotState.MOVE_WHILE_OUTSIDE.value, KilobotState.MOVE_WHILE_INSIDE.value)
+STATIONARY_STATES = (KilobotState.WAIT_TO_MOVE.value, KilobotState.JOINED_SHAPE.value)
+NOT_MOVING_STATES = (KilobotState.START.value,) + STATIONARY_STATES
+
+
+class NeighbourRecord:
+    # Message received from a neighbour. Records are pooled by the receiver and reused every tick
+    __slots__ = ("id", "distance", "gradient", "state", "activation_index", "pos", "bot", "time") # time is only set by event_engine.py
+
+
 class Kilobot:
-    id = 0
-    activation_index = 0
+    __slots__ = ("id", "pos", "rotation", "state", "color", "neighbours", "neighbours_by_state", "neighbour_pool",
+                 "prev_distance", "gradient", "is_seed", "timer", "updates_gradient", "activation_index",
+                 "percieved_pos", "selected_bot", "forwad_speed", "rotation_speed", "iterations_inside_shape",
+                 "use_localise", "joined_shape_time")
+    next_id = 0
+    next_activation_index = 0
+    spatial_hash = None # Rebuilt every tick by update_neighbours
+    frozen_hash = None # Frozen bots, when update_bots is given an ActiveSet
+    noise = Noise() # Movement and sensing noise, replaced by a seeded Noise to reproduce a run
     def __init__(self, pos:tuple, rotation:float, color:str="red", is_seed:bool=False):
-        self.id = Kilobot.id
-        Kilobot.id += 1
+        self.id = Kilobot.next_id
+        Kilobot.next_id += 1
         self.pos = pos
         self.rotation = rotation
         self.state = 0
         self.color = color
-        self.neighbours = [] # Dict of (id, distance, gradient)
+        self.neighbours = [] # NeighbourRecords received this tick
+        self.neighbours_by_state = [[] for _ in KilobotState] # Same records, indexed by the state value of the sender
+        self.neighbour_pool = [] # Every NeighbourRecord ever used by this bot
         self.prev_distance = inf
         self.gradient = inf if is_seed else inf
         self.is_seed = is_seed
@@ -52,8 +79,8 @@ class Kilobot:
         self.activation_index = inf
         self.percieved_pos = (0, 0) if not is_seed else pos
         self.selected_bot = False
-        self.forwad_speed = normalvariate(KILOBOT_FORWARD_SPEED_MEAN, KILOBOT_FORWARD_SPEED_STD) if not DISABLE_MOVEMENT_ERROR else KILOBOT_FORWARD_SPEED_MEAN
-        self.rotation_speed = normalvariate(KILOBOT_ROTATION_SPEED_MEAN, KILOBOT_ROTATION_SPEED_STD) if not DISABLE_MOVEMENT_ERROR else KILOBOT_ROTATION_SPEED_MEAN
+        self.forwad_speed = Kilobot.noise.normal(KILOBOT_FORWARD_SPEED_MEAN, KILOBOT_FORWARD_SPEED_STD) if not DISABLE_MOVEMENT_ERROR else KILOBOT_FORWARD_SPEED_MEAN
+        self.rotation_speed = Kilobot.noise.normal(KILOBOT_ROTATION_SPEED_MEAN, KILOBOT_ROTATION_SPEED_STD) if not DISABLE_MOVEMENT_ERROR else KILOBOT_ROTATION_SPEED_MEAN
         self.iterations_inside_shape = 0
         self.use_localise = True
         self.joined_shape_time = 0
@@ -64,7 +91,9 @@ class Kilobot:
     def move_straight(self, dt):
         movement_x = self.forwad_speed * cos(self.rotation) * dt
         movement_y = self.forwad_speed * sin(self.rotation) * dt
-        error = random() * KILOBOT_FORWARD_SPEED_ERROR * 2 - KILOBOT_FORWARD_SPEED_ERROR
+        error = next(Kilobot.noise.forward, None)
+        if error is None:
+            error = Kilobot.noise.one("forward", KILOBOT_FORWARD_SPEED_ERROR)
         error_x = error * movement_x
         error_y = error * movement_y
         if DISABLE_MOVEMENT_ERROR:
@@ -78,8 +107,8 @@ class Kilobot:
         self.pos = new_position
         
         # Fix position if colliding with other bots
-        for bot in self.neighbours:
-            if self._real_distance_to(bot["object"].pos) < 2 * KILOBOT_RADIUS:
+        for bot in self._nearby_bots():
+            if bot is not self and self._real_distance_to(bot.pos) < 2 * KILOBOT_RADIUS:
                 self.pos = old_pos
                 break
         
@@ -87,7 +116,9 @@ class Kilobot:
         
     def rotate_left(self, dt):
         rotation = self.rotation_speed * dt
-        error = random() * KILOBOT_ROTATION_SPEED_ERROR * 2 - KILOBOT_ROTATION_SPEED_ERROR
+        error = next(Kilobot.noise.rotation, None)
+        if error is None:
+            error = Kilobot.noise.one("rotation", KILOBOT_ROTATION_SPEED_ERROR)
         rotation_error = error * rotation
         if DISABLE_MOVEMENT_ERROR: rotation_error = 0
         new_rotation = self.rotation - rotation + rotation_error
@@ -97,7 +128,9 @@ class Kilobot:
     
     def rotate_right(self, dt):
         rotation = self.rotation_speed * dt
-        error = random() * KILOBOT_ROTATION_SPEED_ERROR * 2 - KILOBOT_ROTATION_SPEED_ERROR
+        error = next(Kilobot.noise.rotation, None)
+        if error is None:
+            error = Kilobot.noise.one("rotation", KILOBOT_ROTATION_SPEED_ERROR)
         rotation_error = error * rotation
         if DISABLE_MOVEMENT_ERROR: rotation_error = 0
         new_rotation = self.rotation + rotation + rotation_error
@@ -108,10 +141,10 @@ class Kilobot:
     def follow_edge(self, dt):
         # Store nearest neighbour in current
         current = inf
-        not_moving_neighbours = [neighbour for neighbour in self.neighbours if neighbour["state"] not in [KilobotState.MOVE_WHILE_INSIDE, KilobotState.MOVE_WHILE_OUTSIDE]]
-        for neighbour in not_moving_neighbours:
-            if neighbour["distance"] < current:
-                current = neighbour["distance"]
+        for state in NOT_MOVING_STATES:
+            for neighbour in self.neighbours_by_state[state]:
+                if neighbour.distance < current:
+                    current = neighbour.distance
                 
         if current < DESIRED_DISTANCE:
             if self.prev_distance < current:
@@ -130,13 +163,16 @@ class Kilobot:
     
     
     def broadcast(self, bots):
+        distance_errors = Kilobot.noise.distance
         for other in bots: # Bot receiving the message
             if other.id == self.id:
                 continue
             
             
             distance = self._real_distance_to(other.pos)
-            error = random() * DISTANCE_ERROR * 2 - DISTANCE_ERROR
+            error = next(distance_errors, None)
+            if error is None:
+                error = Kilobot.noise.one("distance", DISTANCE_ERROR)
             distance_error = error * distance
             if DISABLE_DISTANCE_ERROR: distance_error = 0
             distance += distance_error
@@ -144,7 +180,30 @@ class Kilobot:
             if distance > BROADCAST_RADIUS:
                 continue
             
-            other.neighbours.append({"id": self.id, "distance": distance, "gradient": self.gradient, "state": self.state, "activation_index": self.activation_index, "pos": self.percieved_pos, "object": self})
+            other.receive(self, distance)
+    
+    def receive(self, sender, distance):
+        neighbours = self.neighbours
+        if len(neighbours) < len(self.neighbour_pool):
+            record = self.neighbour_pool[len(neighbours)]
+        else:
+            record = NeighbourRecord()
+            self.neighbour_pool.append(record)
+        
+        record.id = sender.id
+        record.distance = distance
+        record.gradient = sender.gradient
+        record.state = sender.state
+        record.activation_index = sender.activation_index
+        record.pos = sender.percieved_pos
+        record.bot = sender
+        neighbours.append(record)
+        self.neighbours_by_state[sender.state.value].append(record)
+    
+    def clear_neighbours(self):
+        self.neighbours.clear()
+        for records in self.neighbours_by_state:
+            records.clear()
     
     
     def form_gradient(self):
@@ -155,15 +214,12 @@ class Kilobot:
         if not self.updates_gradient:
             return
         
-        neighbours_within_gradient_distance = [neighbour for neighbour in self.neighbours if neighbour["distance"] < GRADIENT_DISTANCE]
-        stationary_neighbours = [neighbour for neighbour in neighbours_within_gradient_distance if neighbour["state"] in (KilobotState.JOINED_SHAPE, KilobotState.WAIT_TO_MOVE)]
-        
-        if len(stationary_neighbours) == 0:
-            self.gradient = inf
-            self.prev_gradient = self.gradient
-            return
-        
-        min_gradient = min([neighbour["gradient"] for neighbour in stationary_neighbours])
+        # No stationary neighbour within GRADIENT_DISTANCE leaves the gradient at inf
+        min_gradient = inf
+        for state in STATIONARY_STATES:
+            for neighbour in self.neighbours_by_state[state]:
+                if neighbour.distance < GRADIENT_DISTANCE and neighbour.gradient < min_gradient:
+                    min_gradient = neighbour.gradient
         self.gradient = min_gradient + 1
 
 
@@ -174,15 +230,15 @@ class Kilobot:
         if self.state == KilobotState.JOINED_SHAPE and not self.use_localise:
             return
         
-        localised_stationary_neighbours = [neighbour for neighbour in self.neighbours if neighbour["state"] in [KilobotState.JOINED_SHAPE]]
+        localised_stationary_neighbours = self.neighbours_by_state[KilobotState.JOINED_SHAPE.value]
         if len(localised_stationary_neighbours) < 3:
             return
 
         for neighbour in localised_stationary_neighbours:
-            c = self._percieved_distance_to(neighbour["pos"])
-            v = (self.percieved_pos[0] - neighbour["pos"][0], self.percieved_pos[1] - neighbour["pos"][1])
+            c = self._percieved_distance_to(neighbour.pos)
+            v = (self.percieved_pos[0] - neighbour.pos[0], self.percieved_pos[1] - neighbour.pos[1])
             v = (v[0] / c, v[1] / c)
-            n = (neighbour["pos"][0] + neighbour["distance"] * v[0], neighbour["pos"][1] + neighbour["distance"] * v[1])
+            n = (neighbour.pos[0] + neighbour.distance * v[0], neighbour.pos[1] + neighbour.distance * v[1])
             self.percieved_pos = (self.percieved_pos[0] - (self.percieved_pos[0] - n[0]), self.percieved_pos[1] - (self.percieved_pos[1] - n[1]))
     
     def perfect_localise(self):
@@ -203,29 +259,39 @@ class Kilobot:
             return
 
         if self.state == KilobotState.WAIT_TO_MOVE:
-            neighbour_states = [neighbour["state"] for neighbour in self.neighbours]
-            if len(neighbour_states) == 0:
+            if len(self.neighbours) == 0:
                     self.state = KilobotState.MOVE_WHILE_OUTSIDE
                     return
-                
-            moving_neighbour = KilobotState.MOVE_WHILE_INSIDE in neighbour_states or KilobotState.MOVE_WHILE_OUTSIDE in neighbour_states
+
+            # Only happens with asynchronous clocks, in lock-step every bot leaves START in the same tick
+            if self.neighbours_by_state[KilobotState.START.value]:
+                return
+
+            moving_neighbour = any(self.neighbours_by_state[state] for state in MOVING_STATES)
             if not moving_neighbour:
-                waiting_neighbours = [neighbour for neighbour in self.neighbours if neighbour["state"] == KilobotState.WAIT_TO_MOVE]
+                waiting_neighbours = self.neighbours_by_state[KilobotState.WAIT_TO_MOVE.value]
                 if len(waiting_neighbours) == 0:
                     self.state = KilobotState.MOVE_WHILE_OUTSIDE
                     return
-                highest_gradient = max([neighbour["gradient"] for neighbour in waiting_neighbours])
-                highest_gradient_neighbours = [neighbour for neighbour in waiting_neighbours if neighbour["gradient"] == highest_gradient]
+                # Highest gradient of the waiting neighbours and highest id among the ones with that gradient
+                highest_gradient = -inf
+                highest_id = -inf
+                for neighbour in waiting_neighbours:
+                    if neighbour.gradient > highest_gradient:
+                        highest_gradient = neighbour.gradient
+                        highest_id = neighbour.id
+                    elif neighbour.gradient == highest_gradient and neighbour.id > highest_id:
+                        highest_id = neighbour.id
                 if self.gradient > highest_gradient:
                     self.state = KilobotState.MOVE_WHILE_OUTSIDE
-                elif self.gradient == highest_gradient and self.id > max([neighbour["id"] for neighbour in highest_gradient_neighbours]):
+                elif self.gradient == highest_gradient and self.id > highest_id:
                     self.state = KilobotState.MOVE_WHILE_OUTSIDE
             return
         
         if self.state == KilobotState.MOVE_WHILE_OUTSIDE:
             if self.activation_index == inf:
-                self.activation_index = Kilobot.activation_index
-                Kilobot.activation_index += 1
+                self.activation_index = Kilobot.next_activation_index
+                Kilobot.next_activation_index += 1
                 
             if position_inside_shape(self.percieved_pos, shape):
                 self.iterations_inside_shape += 1
@@ -235,32 +301,26 @@ class Kilobot:
             else:
                 self.iterations_inside_shape = 0
             
-            moving_prior_neighbours = [neighbour for neighbour in self.neighbours if neighbour["state"] in [KilobotState.MOVE_WHILE_INSIDE, KilobotState.MOVE_WHILE_OUTSIDE] and neighbour["activation_index"] < self.activation_index]
-            if len(moving_prior_neighbours) <= 0:
+            # Yield to bots that started moving earlier
+            if self._closest_prior_moving_distance() > YIELD_DISTANCE:
                 self.follow_edge(dt)
-            else:
-                closest_edge_following_neighbour = min([neighbour["distance"] for neighbour in moving_prior_neighbours])
-                if closest_edge_following_neighbour > YIELD_DISTANCE:
-                    self.follow_edge(dt)
             return
 
         if self.state == KilobotState.MOVE_WHILE_INSIDE:
             if not position_inside_shape(self.percieved_pos, shape):
                 self.state = KilobotState.JOINED_SHAPE
                 self.joined_shape_time = 0
-            closes_neighbour_distance = min([neighbour["distance"] for neighbour in self.neighbours])
-            closest_neighbour = [neighbour for neighbour in self.neighbours if neighbour["distance"] == closes_neighbour_distance][0]
-            if self.gradient == closest_neighbour["gradient"]: #and not self.going_down_gradient:
+            closest_neighbour = self.neighbours[0]
+            for neighbour in self.neighbours:
+                if neighbour.distance < closest_neighbour.distance:
+                    closest_neighbour = neighbour
+            if self.gradient == closest_neighbour.gradient: #and not self.going_down_gradient:
                 self.state = KilobotState.JOINED_SHAPE
                 self.joined_shape_time = 0
                 
-            moving_prior_neighbours = [neighbour for neighbour in self.neighbours if neighbour["state"] in [KilobotState.MOVE_WHILE_INSIDE, KilobotState.MOVE_WHILE_OUTSIDE] and neighbour["activation_index"] < self.activation_index]
-            if len(moving_prior_neighbours) <= 0:
+            # Yield to bots that started moving earlier
+            if self._closest_prior_moving_distance() > YIELD_DISTANCE:
                 self.follow_edge(dt)
-            else:
-                closest_edge_following_neighbour = min([neighbour["distance"] for neighbour in moving_prior_neighbours])
-                if closest_edge_following_neighbour > YIELD_DISTANCE:
-                    self.follow_edge(dt)
             return
         
         if self.state == KilobotState.JOINED_SHAPE:
@@ -287,6 +347,7 @@ class Kilobot:
     
     
     def draw_additional_info(self, screen):
+        import pygame
         # Show percieved position
         pygame.draw.circle(screen, "blue", self.percieved_pos, 5)
         
@@ -295,13 +356,32 @@ class Kilobot:
         
         # Outline neighbours
         for neighbour in self.neighbours:
-            pygame.draw.circle(screen, "green", neighbour["pos"], KILOBOT_RADIUS, 1)
+            pygame.draw.circle(screen, "green", neighbour.pos, KILOBOT_RADIUS, 1)
     
     
+    def is_frozen(self):
+        # Frozen bots never move or change again
+        return self.state == KilobotState.JOINED_SHAPE and not self.use_localise
+    
     def location_error(self):
         return self._real_distance_to(self.percieved_pos)
     
                 
+    def _closest_prior_moving_distance(self):
+        closest = inf
+        for state in MOVING_STATES:
+            for neighbour in self.neighbours_by_state[state]:
+                if neighbour.activation_index < self.activation_index and neighbour.distance < closest:
+                    closest = neighbour.distance
+        return closest
+    
+    def _nearby_bots(self):
+        if Kilobot.spatial_hash is None:
+            return [neighbour.bot for neighbour in self.neighbours]
+        if Kilobot.frozen_hash is not None:
+            return Kilobot.spatial_hash.query(self.pos) + Kilobot.frozen_hash.query(self.pos)
+        return Kilobot.spatial_hash.query(self.pos)
+
     def _fix_rotation(self):
         self.rotation %= 2 * pi
     
@@ -313,43 +393,205 @@ class Kilobot:
     
 
 
-pygame.font.init()
-font = pygame.font.Font(None, 20)
+# pygame is only imported once something is drawn, headless runs never load it
+font = None # Font of the gradient labels, created with the first one
+gradient_labels = {} # Rendered gradient labels by gradient
+bot_sprites = {} # Bot circles by color
+
+def gradient_label(gradient):
+    global font
+    label = gradient_labels.get(gradient)
+    if label is None:
+        if font is None:
+            import pygame
+            pygame.font.init()
+            font = pygame.font.Font(None, 20)
+        label = font.render(str(gradient), True, "white")
+        gradient_labels[gradient] = label
+    return label
+
+def bot_sprite(color):
+    sprite = bot_sprites.get(color)
+    if sprite is None:
+        import pygame
+        sprite = pygame.Surface((2 * KILOBOT_RADIUS, 2 * KILOBOT_RADIUS), pygame.SRCALPHA)
+        pygame.draw.circle(sprite, color, (KILOBOT_RADIUS, KILOBOT_RADIUS), KILOBOT_RADIUS)
+        bot_sprites[color] = sprite
+    return sprite
+
+def draw_bot(screen, bot, draw_gradient=True):
+    import pygame
+    screen.blit(bot_sprite(bot.color), (bot.pos[0] - KILOBOT_RADIUS, bot.pos[1] - KILOBOT_RADIUS))
+    end = (bot.pos[0] + 10 * cos(bot.rotation), bot.pos[1] + 10 * sin(bot.rotation))
+    pygame.draw.line(screen, "#1D3557", bot.pos, end, 2)
+    if draw_gradient:
+        text = gradient_label(bot.gradient)
+        text_pos = (bot.pos[0] + 1 - text.get_width() / 2, bot.pos[1] + 1 - text.get_height() / 2)
+        screen.blit(text, text_pos)
+
 def draw_bots(screen, bots, draw_gradient=True):
     for bot in bots:
-        pygame.draw.circle(screen, bot.color, bot.pos, KILOBOT_RADIUS)
-        end = (bot.pos[0] + 10 * cos(bot.rotation), bot.pos[1] + 10 * sin(bot.rotation))
-        pygame.draw.line(screen, "#1D3557", bot.pos, end, 2)
-        if draw_gradient:
-            text = font.render(str(bot.gradient), True, "white")
-            text_pos = (bot.pos[0] + 1 - text.get_width() / 2, bot.pos[1] + 1 - text.get_height() / 2)
-            screen.blit(text, text_pos)
+        draw_bot(screen, bot, draw_gradient)
 
     for bot in bots:
         if bot.selected_bot:
             bot.draw_additional_info(screen)
     
-def update_neighbours(bots):
-    for bot in bots:
-        bot.neighbours = []
-        
+def neighbour_cell_size():
+    # Cells must cover the largest distance that can still be percieved as inside BROADCAST_RADIUS, which
+    # is heard when d * (1 + e) <= BROADCAST_RADIUS for some e >= -DISTANCE_ERROR
+    if DISTANCE_ERROR >= 1:
+        return inf
+    return BROADCAST_RADIUS / (1 - DISTANCE_ERROR)
+
+def update_neighbours(bots, frozen_hash=None):
     for bot in bots:
-        bot.broadcast(bots)
+        bot.clear_neighbours()
     
-def update_bots(bots, dt, shape, enable_trilateration=False):
-    update_neighbours(bots)
+    cell_size = neighbour_cell_size()
+    if Kilobot.spatial_hash is None or Kilobot.spatial_hash.cell_size != cell_size:
+        Kilobot.spatial_hash = SpatialHash(cell_size)
+    Kilobot.spatial_hash.rebuild(bots)
     
-    for bot in bots:
-        bot.form_gradient()
-        bot.localise() if enable_trilateration else bot.perfect_localise()
-        bot.self_assembly(dt, shape)
-        bot.update_color()
+    # One distance error per pair the broadcasts evaluate, drawn for the whole tick at once
+    Kilobot.noise.distance = Kilobot.noise.errors("distance", broadcast_pairs(frozen_hash), DISTANCE_ERROR)
+    
+    # Bots only broadcast to the bots in the surrounding cells
+    for cell, cell_bots in Kilobot.spatial_hash.cells.items():
+        candidates = Kilobot.spatial_hash.candidates(cell)
+        for bot in cell_bots:
+            bot.broadcast(candidates)
+    
+    # Frozen bots only broadcast, they keep the neighbours they had when they froze
+    Kilobot.frozen_hash = frozen_hash
+    if frozen_hash is not None:
+        for cell, cell_bots in Kilobot.spatial_hash.cells.items():
+            for bot in frozen_hash.candidates(cell):
+                bot.broadcast(cell_bots)
+    
+def draw_movement_noise(bots):
+    # Every bot moves straight and rotates at most once per tick
+    Kilobot.noise.forward = Kilobot.noise.errors("forward", len(bots), KILOBOT_FORWARD_SPEED_ERROR)
+    Kilobot.noise.rotation = Kilobot.noise.errors("rotation", len(bots), KILOBOT_ROTATION_SPEED_ERROR)
+
+def broadcast_pairs(frozen_hash=None):
+    # Sender and receiver pairs evaluated by update_neighbours
+    pairs = 0
+    for cell, cell_bots in Kilobot.spatial_hash.cells.items():
+        pairs += len(cell_bots) * len(Kilobot.spatial_hash.candidates(cell))
+        if frozen_hash is not None:
+            pairs += len(cell_bots) * len(frozen_hash.candidates(cell))
+    return pairs
+
+def least_squares_localise(pos, receivers, neighbour_pos, distances, iterations=LEAST_SQUARES_ITERATIONS):
+    # Damped Gauss-Newton steps minimising the sum of (|p - q| - d)^2 over the neighbours q of every
+    # receiver at once, pos is updated in place. Unlike localise the result does not depend on the
+    # order of the neighbours.
+    bots, receivers = np.unique(receivers, return_inverse=True)
+    m = len(bots)
+    if m == 0:
+        return
+    for _ in range(iterations):
+        v = pos[bots][receivers] - neighbour_pos
+        c = np.hypot(v[:, 0], v[:, 1])
+        valid = c > 0
+        ux, uy = v[valid, 0] / c[valid], v[valid, 1] / c[valid]
+        r = c[valid] - distances[valid]
+        valid_receivers = receivers[valid]
+        axx = np.bincount(valid_receivers, ux * ux, m)
+        axy = np.bincount(valid_receivers, ux * uy, m)
+        ayy = np.bincount(valid_receivers, uy * uy, m)
+        bx = np.bincount(valid_receivers, ux * r, m)
+        by = np.bincount(valid_receivers, uy * r, m)
+        damping = LEAST_SQUARES_DAMPING * (axx + ayy)
+        axx += damping
+        ayy += damping
+        det = axx * ayy - axy * axy
+        solvable = det > 0
+        det[~solvable] = 1
+        step = np.stack((ayy * bx - axy * by, axx * by - axy * bx), axis=1) / det[:, None]
+        pos[bots[solvable]] -= step[solvable]
+
+def localise_least_squares(bots):
+    # The bots localise like in Kilobot.localise, from their joined neighbours, all in one batched solve
+    joined = KilobotState.JOINED_SHAPE.value
+    localising = [bot for bot in bots if not bot.is_seed and (bot.state != KilobotState.JOINED_SHAPE or bot.use_localise)
+                  and len(bot.neighbours_by_state[joined]) >= 3]
+    if not localising:
+        return
+    rows = [(i, *record.pos, record.distance) for i, bot in enumerate(localising) for record in bot.neighbours_by_state[joined]]
+    table = np.array(rows, dtype=float)
+    pos = np.array([bot.percieved_pos for bot in localising], dtype=float)
+    least_squares_localise(pos, table[:, 0].astype(np.intp), table[:, 1:3], table[:, 3])
+    for bot, bot_pos in zip(localising, pos.tolist()):
+        bot.percieved_pos = tuple(bot_pos)
+
+def update_bots(bots, dt, shape, enable_trilateration=False, gradient_field=None, active_set=None, profiler=None):
+    # With an active set only the awake bots are updated. enable_trilateration is one of LOCALISATION_MODES.
+    all_bots = bots
+    frozen_hash = None
+    laps = profiler.laps() if profiler is not None else None
+    if active_set is not None:
+        active_set.sync(all_bots)
+        bots, frozen_hash = active_set.awake, active_set.frozen_hash
+    
+    update_neighbours(bots, frozen_hash)
+    draw_movement_noise(bots)
+    if laps: laps.lap("neighbours")
+    
+    # The gradient field sets the gradients of the stationary bots, only the rest form it every tick
+    if gradient_field is not None:
+        gradient_field.update(all_bots)
+    
+    localise = Kilobot.localise if enable_trilateration else Kilobot.perfect_localise
+    if enable_trilateration == LEAST_SQUARES:
+        localise = None
+    
+    if laps is None:
+        # The batched solve only reads the neighbour records, so it can run before the loop over the bots
+        if localise is None:
+            localise_least_squares(bots)
+        for bot in bots:
+            if gradient_field is None or bot.id not in gradient_field.nodes:
+                bot.form_gradient()
+            if localise is not None:
+                localise(bot)
+            bot.self_assembly(dt, shape)
+            bot.update_color()
+    else:
+        # One loop per phase to time them, every phase only reads the neighbour records of this tick
+        # and every kind of noise has its own stream, so the result is the same
+        for bot in bots:
+            if gradient_field is None or bot.id not in gradient_field.nodes:
+                bot.form_gradient()
+        laps.lap("gradient")
+        if localise is None:
+            localise_least_squares(bots)
+        else:
+            for bot in bots:
+                localise(bot)
+        laps.lap("localise")
+        for bot in bots:
+            bot.self_assembly(dt, shape)
+            bot.update_color()
+        laps.lap("assembly")
+    
+    if active_set is not None:
+        active_set.freeze_settled()
+    
+    if laps:
+        laps.lap("active set")
+        profiler.count_tick(all_bots, broadcast_pairs(frozen_hash), sum(len(bot.neighbour_pool) for bot in all_bots))
+
 
+def load_shape(image_file):
+    # Returns the image and its CompiledShape, the origin of the shape is the red pixel. Runs that never
+    # draw the image only need load_compiled_shape.
+    import pygame
+    return pygame.image.load(image_file), load_compiled_shape(image_file)
 
 def position_inside_shape(pos, shape):
-    x, y = pos
-    x, y = int(x), int(y)
-    return (shape[x,y] == (0,0,0)).all()
+    return shape.contains(pos)
 
 def generate_kilobots(shape_origin, rows, cols):
     bots = []
@@ -382,7 +624,7 @@ def generate_kilobot_grid(rows, cols, start_pos):
         for j in range(cols):
             x = start_pos[0] - j * 2.5 * KILOBOT_RADIUS + offset
             y = start_pos[1] + i * 2.5 * KILOBOT_RADIUS
-            rotation =  random() * 2 * pi
+            rotation =  Kilobot.noise.uniform(0, 2 * pi)
             bots.append(Kilobot((x, y), rotation))
     
     return bots
@@ -395,4 +637,6 @@ def remove_bots_not_forming_shape(bots):
 
 def average_location_error(bots):
     location_errors = [bot.location_error() for bot in bots]
+    if len(location_errors) == 0:
+        return None
     return sum(location_errors) / len(location_errors)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import multiprocessing
+from queue import Empty
+
+PLOT_INTERVAL = 0.1 # Real seconds between redraws of the plot
+
+
+class LivePlot:
+    # Location error chart drawn by a separate process, the simulation only puts new points on a queue.
+    # The process, and matplotlib with it, only starts once there is a first point to plot.
+    def __init__(self, title="Location error"):
+        self.title = title
+        self.queue = None
+        self.process = None
+        self.sent = 0
+
+    def update(self, metrics):
+        if len(metrics.location_errors) > self.sent:
+            if self.process is None:
+                context = multiprocessing.get_context("spawn")
+                self.queue = context.Queue()
+                self.process = context.Process(target=_plot_process, args=(self.queue, self.title), daemon=True)
+                self.process.start()
+            if self.process.is_alive():
+                self.queue.put(metrics.location_errors.since(self.sent).tolist())
+        self.sent = len(metrics.location_errors)
+
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.queue.put(None)
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def _plot_process(queue, title):
+    import matplotlib.pyplot as plt
+    plt.ion()
+    figure, axes = plt.subplots()
+    axes.set_title(title)
+    axes.set_xlabel("Bots forming shape")
+    axes.set_ylabel("Location error (px)")
+    axes.grid()
+    line, = axes.plot([], [], 'b')
+    errors = []
+    plt.show()
+
+    # Runs until the simulation closes the plot or the window is closed
+    while plt.fignum_exists(figure.number):
+        plt.pause(PLOT_INTERVAL)
+        points = []
+        try:
+            while True:
+                points.append(queue.get_nowait())
+        except Empty:
+            pass
+        if None in points:
+            break
+        if points:
+            for batch in points:
+                errors.extend(batch)
+            line.set_data(range(len(errors)), errors)
+            axes.relim()
+            axes.autoscale_view()
+            figure.canvas.draw_idle()
+    plt.close(figure)
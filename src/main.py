@@ -1,44 +1,64 @@
-import pygame
 import os
-import matplotlib.pyplot as plt
-import json
+import argparse
+import pygame
 from math import sin, cos, pi
-from kilobot import Kilobot, KILOBOT_RADIUS, draw_bots, update_bots, KilobotState, generate_kilobots, remove_bots_not_forming_shape, average_location_error
+from kilobot import Kilobot, KILOBOT_RADIUS, LOCALISATION_MODES, LEAST_SQUARES, update_bots, KilobotState, generate_kilobots, remove_bots_not_forming_shape, average_location_error, load_shape
+from results import ResultsStore
+from array_swarm import ArraySwarm
+from partitioned import PartitionedSwarm
+from event_engine import EventEngine
+from gradient_field import GradientField
+from active_set import ActiveSet
+from renderer import Renderer
+from fixed_timestep import FixedTimestep
+from metrics import MetricsSink
+from live_plot import LivePlot
+from trajectory import Trajectory, REMOVED
+from checkpoint import save_checkpoint, load_checkpoint
+from profiler import PhaseProfiler
+from convergence import ConvergenceMonitor
 
 BACKGROUND_TILE_SIZE = 32
 MS_PER_UPDATE = 100
+RENDER_FPS = 60
+SIMULATION_FRAME_BUDGET = 0.8 # Fraction of each rendered frame that can be spent on simulation steps
+DEFAULT_TIME_WARP = 10 # Simulated seconds per real second, [W] cycles through fixed_timestep.TIME_WARPS
 TEST_NAME = "arrow_bad"
-OUTPUT_FILE = f"info/output_info.json"
+OUTPUT_FILE = "info/results.jsonl"
+CHECKPOINT_FILE = "info/checkpoint.pkl"
+TRACE_FILE = "info/trace.json" # Chrome trace of the profiled frames, [X] exports it
 IMAGE_FILE = "shapes/arrow.png"
+USE_ARRAY_ENGINE = False # Simulate the swarm with the NumPy engine in array_swarm.py
+PARTITIONED_WORKERS = 0 # Simulate the swarm in this many processes with the engine in partitioned.py, 0 to not use it
+USE_EVENT_ENGINE = False # Simulate the bots with asynchronous clocks with the engine in event_engine.py
+USE_INCREMENTAL_GRADIENT = False # Recompute the gradients of the stationary bots only when their neighbours change, see gradient_field.py
+USE_ACTIVE_SET = True # Only update the bots that are not frozen, see active_set.py
+STOP_WHEN_CONVERGED = True # Pause and save the results once the shape is formed or no bot joins any more, see convergence.py
+LOCALISATION_NAMES = {True: "trilateration", LEAST_SQUARES: "least squares", False: "perfect"}
+REPLAY_SPEEDS = (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100) # Recorded seconds per real second, [UP] and [DOWN] change it
 
-def save_graph_info_json(location_errors, timer, forming_shape_bots, average_error, test_name):
-    if os.path.exists(OUTPUT_FILE):
-        # Open OUTPUT_FILE and read the content as json
-        with open(OUTPUT_FILE, "r") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = {}
-    else:
-        data = {}
+def final_results(metrics, bots, converged=None):
+    # Results of the run so far, saved by [S] or once the run converged
+    forming_shape_bots = [bot for bot in bots if bot.state == KilobotState.JOINED_SHAPE]
+    result = {"test_name": TEST_NAME, "errors": metrics.location_errors.values.tolist(), "time": metrics.last_join_time,
+              "bots": len(metrics), "average_error": average_location_error(forming_shape_bots)}
+    if converged:
+        result["converged"] = converged
+    return result
 
-    # Update the data with the new test information
-    data[test_name] = {"errors": location_errors, "time": timer, "bots": forming_shape_bots, "average_error": average_error}
-
-    # Write the updated data back to the file
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(data, f, indent=4)
-        
-def main():
+def main(resume=None):
     display_desired_shape = True
     display_grid = True
     display_gradient = True
     display_bots = True
     enable_update = True
-    location_errors = []
-    number_of_last_forming_shape_bots = 0
-    last_forming_shape_bots = []
     enable_trilateration = True
+    image_file = IMAGE_FILE
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(resume)
+        image_file = checkpoint["image_file"]
+        enable_trilateration = checkpoint["settings"].get("enable_trilateration", enable_trilateration)
     
     # pygame setup
     pygame.init()
@@ -47,39 +67,48 @@ def main():
     running = True
     font = pygame.font.SysFont(None, 24)
     timer = 0
-    last_robot_join_time = 0
+    timestep = FixedTimestep(MS_PER_UPDATE / 1000, SIMULATION_FRAME_BUDGET / RENDER_FPS, DEFAULT_TIME_WARP)
     
     # Load shape image
-    shape = pygame.image.load(IMAGE_FILE)
+    shape, compiled_shape = load_shape(image_file)
+    shape_origin = compiled_shape.origin
     shape.set_colorkey ((255, 255, 255))
     shape.set_alpha(77)
+    renderer = Renderer(screen, shape, BACKGROUND_TILE_SIZE, font)
     
-    # Find red pixel
-    shape_origin = None
-    for x in range(shape.get_width()):
-        for y in range(shape.get_height()):
-            if shape.get_at((x, y)) == (255, 0, 0, 255):
-                shape_origin = (x, y)
-    
-    # Generate bots
+    # Generate bots, or continue the ones of the checkpoint. Join events go to the metrics sink and the
+    # error graph is drawn by its own process.
     if not shape_origin:
         print("Shape origin not found")
         return
-    bots = generate_kilobots(shape_origin, 10, 20)
-    
-    # Convert to array
-    shape_array = pygame.surfarray.array3d(shape)
-    
-    # Create error graph
-    plt.ion()
-    plt.figure()
-    plt.title("Location error")
-    plt.xlabel("Bots forming shape")
-    plt.ylabel("Location error (px)")
-    plt.grid()
-    plt.show()
+    if checkpoint:
+        bots, swarm = checkpoint["bots"], checkpoint["swarm"]
+        gradient_field, active_set = checkpoint["gradient_field"], checkpoint["active_set"]
+        timer, metrics = checkpoint["timer"], checkpoint["metrics"]
+    else:
+        bots = generate_kilobots(shape_origin, 10, 20)
+        swarm = None
+        gradient_field = None
+        active_set = None
+        if PARTITIONED_WORKERS:
+            swarm = PartitionedSwarm.from_kilobots(bots, workers=PARTITIONED_WORKERS)
+            bots = swarm.bots
+        elif USE_ARRAY_ENGINE:
+            swarm = ArraySwarm.from_kilobots(bots)
+            bots = swarm.bots
+        elif USE_EVENT_ENGINE:
+            swarm = EventEngine(bots, MS_PER_UPDATE / 1000)
+        else:
+            gradient_field = GradientField() if USE_INCREMENTAL_GRADIENT else None
+            active_set = ActiveSet() if USE_ACTIVE_SET else None
+        metrics = MetricsSink()
+    live_plot = LivePlot()
+    profiler = None # [P] switches it on, nothing is timed while it is None
+    monitor = ConvergenceMonitor(compiled_shape, timer) if STOP_WHEN_CONVERGED else None
+    converged = False # The run pauses and is saved the first time it converges, [SPACE] continues it
 
     while running:
+        frame = profiler.laps("frame") if profiler else None
         # poll for events
         # pygame.QUIT event means the user clicked X to close your window
         for event in pygame.event.get():
@@ -97,58 +126,67 @@ def main():
                 if event.key == pygame.K_SPACE:
                     enable_update = not enable_update
                 if event.key == pygame.K_ESCAPE:
-                    bots = remove_bots_not_forming_shape(bots)
+                    if swarm:
+                        swarm.remove_bots_not_forming_shape()
+                        bots = swarm.bots
+                    else:
+                        bots = remove_bots_not_forming_shape(bots)
+                        # Nothing may keep the removed bots, a checkpoint only saves the bots in bots
+                        if active_set:
+                            active_set.sync(bots)
+                        if gradient_field:
+                            gradient_field.prune(bots)
                 if event.key == pygame.K_s:
-                    avg_error = average_location_error(forming_shape_bots)
-                    save_graph_info_json(location_errors, last_robot_join_time, number_of_last_forming_shape_bots, avg_error, TEST_NAME)
+                    ResultsStore(OUTPUT_FILE).append(final_results(metrics, bots))
                 if event.key == pygame.K_t:
-                    enable_trilateration = not enable_trilateration
+                    enable_trilateration = LOCALISATION_MODES[(LOCALISATION_MODES.index(enable_trilateration) + 1) % len(LOCALISATION_MODES)]
+                if event.key == pygame.K_w:
+                    timestep.next_time_warp()
+                if event.key == pygame.K_c:
+                    save_checkpoint(CHECKPOINT_FILE, timer, image_file, bots, swarm, gradient_field, active_set, metrics,
+                                    {"enable_trilateration": enable_trilateration, "dt": timestep.dt})
+                if event.key == pygame.K_p:
+                    profiler = None if profiler else PhaseProfiler()
+                    frame = None
+                if event.key == pygame.K_x and profiler:
+                    os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+                    profiler.export_trace(TRACE_FILE)
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
                     for bot in bots:
                         if bot._real_distance_to(event.pos) < KILOBOT_RADIUS:
                             bot.selected_bot = not bot.selected_bot
-
-        
-        # Update bots
-        # dt = (clock.get_time() / 1000)
-        dt = MS_PER_UPDATE / 1000
+        if frame: frame.lap("events")
         
-        if enable_update:
+        # Update bots, as many fixed dt steps as the time warp asks for and the frame budget allows. The
+        # steps are wider while no bot moves.
+        if monitor:
+            timestep.dt = monitor.step_dt(MS_PER_UPDATE / 1000)
+        dt = timestep.dt
+        timestep.start_frame(clock.get_time() / 1000 if enable_update else 0)
+        while enable_update and timestep.next_step():
             timer += dt
-            update_bots(bots, dt, shape_array, enable_trilateration=enable_trilateration)
+            if swarm:
+                swarm.update_bots(dt, compiled_shape, enable_trilateration=enable_trilateration, profiler=profiler)
+            else:
+                update_bots(bots, dt, compiled_shape, enable_trilateration=enable_trilateration, gradient_field=gradient_field,
+                            active_set=active_set, profiler=profiler)
+
+            # Check robots forming shape, after every step so no joined bot is missed
+            metrics.record_joins(bots, timer, swarm)
+            # The monitor is kept up to date after converging, as its moving bots set the width of the steps
+            if monitor and monitor.update(timer, bots, swarm) and not converged:
+                converged = True
+                enable_update = False
+                ResultsStore(OUTPUT_FILE).append(final_results(metrics, bots, monitor.reason))
+
+        if frame: frame.lap("simulation")
 
-        # Check robots forming shape
         forming_shape_bots = [bot for bot in bots if bot.state == KilobotState.JOINED_SHAPE]
         number_of_forming_shape_bots = len(forming_shape_bots)
-        if number_of_forming_shape_bots != number_of_last_forming_shape_bots:
-            # Find new bot
-            new_bot = [bot for bot in forming_shape_bots if bot not in last_forming_shape_bots][0]
-            
-            location_errors.append(new_bot.location_error())
-            number_of_last_forming_shape_bots = number_of_forming_shape_bots
-            last_forming_shape_bots = forming_shape_bots
-            # Update graph
-            plt.plot(location_errors, 'b')
-            plt.draw()
-            plt.pause(0.001)
-            last_robot_join_time = timer
-            
-
-        # Render game
-        for x in range(0, 1280, BACKGROUND_TILE_SIZE):
-            for y in range(0, 720, BACKGROUND_TILE_SIZE):
-                pygame.draw.rect(screen, "#f1faee", (x, y, BACKGROUND_TILE_SIZE, BACKGROUND_TILE_SIZE), 0)
-                if display_grid:
-                    pygame.draw.rect(screen, (230,230,230), (x, y, BACKGROUND_TILE_SIZE, BACKGROUND_TILE_SIZE), 1)
-                    
-        if display_desired_shape:
-            screen.blit(shape, (640 - shape.get_width()//2, 360 - shape.get_height()//2))
-        
-        if display_bots:
-            draw_bots(screen, bots, display_gradient)
-        
-        
+        live_plot.update(metrics)
+        if frame: frame.lap("plot")
+
         # Show controls and info in bottom left
         texts = [
             "Controls: ",
@@ -159,26 +197,148 @@ def main():
             f"[SPACE]: Enable update: {enable_update}",
             "[ESC]: Remove all bots not forming shape",
             "[S]: Save graph info to file",
-            f"[T]: Toggle trilateration: {enable_trilateration}",
+            "[C]: Save checkpoint, resume it with --resume",
+            f"[T]: Localisation: {LOCALISATION_NAMES[enable_trilateration]}",
+            f"[P]: Profile phases: {profiler is not None}" + (", [X]: Export trace" if profiler else ""),
             f"Click on a bot for more info",
             "",
             f"Simulation time: {timer:.2f} seconds",
+            f"[W]: Time warp: {timestep.time_warp_text()}",
             f"FPS: {int(clock.get_fps())}",
+            f"Steps/s: {timestep.update_rate():.0f}",
             f"Total bots: {len(bots)} (Forming shape: {number_of_forming_shape_bots})"
         ]
-        distance_between_lines = 20
-        for i in range(len(texts)):
-            line_i = len(texts) - i - 1
-            text = font.render(texts[i], True, (0, 0, 0))
-            screen.blit(text, (10, 720 - (line_i + 1) * distance_between_lines))
+        if monitor:
+            texts.append(monitor.text())
+        if profiler:
+            texts += profiler.texts()
         
+        # Render game, only the areas that changed are put on screen
+        renderer.render(bots, texts, display_grid, display_desired_shape, display_gradient, display_bots)
+        if frame: frame.lap("render")
 
-        # flip() the display to put your work on screen
-        pygame.display.flip()
+        clock.tick(RENDER_FPS)  # limits FPS, the simulation speed depends on the time warp
 
-        clock.tick(60)  # limits FPS to 60
+    live_plot.close()
+    if isinstance(swarm, PartitionedSwarm):
+        swarm.close()
+    pygame.quit()
+
+
+def replay(trajectory_dir):
+    # Plays back a trajectory recorded by headless.py --record straight from its memory-mapped arrays
+    trajectory = Trajectory(trajectory_dir)
+    if len(trajectory) == 0:
+        print("Trajectory has no recorded ticks")
+        return
+    display_desired_shape = True
+    display_grid = True
+    display_gradient = True
+    display_bots = True
+    playing = True
+    speed_index = REPLAY_SPEEDS.index(DEFAULT_TIME_WARP)
+    direction = 1
+
+    pygame.init()
+    screen = pygame.display.set_mode((1280, 720))
+    clock = pygame.time.Clock()
+    running = True
+    font = pygame.font.SysFont(None, 24)
+    shape, _ = load_shape(trajectory.info.get("image_file", IMAGE_FILE))
+    shape.set_colorkey ((255, 255, 255))
+    shape.set_alpha(77)
+    renderer = Renderer(screen, shape, BACKGROUND_TILE_SIZE, font)
+
+    # The ticks are copied into an array swarm, so its bot views are drawn like in a live simulation
+    swarm = ArraySwarm(len(trajectory.ids))
+    swarm.ids[:] = trajectory.ids
+    swarm.is_seed[:] = trajectory.is_seed
+    start_time, end_time = trajectory.times[0], trajectory.times[-1]
+    replay_time = start_time
+    tick = 0
+    shown_tick = None
+    bots = []
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_1:
+                    display_desired_shape = not display_desired_shape
+                if event.key == pygame.K_2:
+                    display_grid = not display_grid
+                if event.key == pygame.K_3:
+                    display_gradient = not display_gradient
+                if event.key == pygame.K_4:
+                    display_bots = not display_bots
+                if event.key == pygame.K_SPACE:
+                    playing = not playing
+                if event.key == pygame.K_UP:
+                    speed_index = min(speed_index + 1, len(REPLAY_SPEEDS) - 1)
+                if event.key == pygame.K_DOWN:
+                    speed_index = max(speed_index - 1, 0)
+                if event.key == pygame.K_r:
+                    direction = -direction
+                if event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                    step = 1 if event.key == pygame.K_RIGHT else -1
+                    playing = False
+                    replay_time = trajectory.times[min(max(tick + step, 0), len(trajectory) - 1)]
+                if event.key == pygame.K_HOME:
+                    replay_time = start_time
+                if event.key == pygame.K_END:
+                    replay_time = end_time
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                for bot in bots:
+                    if bot._real_distance_to(event.pos) < KILOBOT_RADIUS:
+                        bot.selected_bot = not bot.selected_bot
+            # Right mouse button seeks, the window width is the whole run
+            if (event.type == pygame.MOUSEBUTTONDOWN and event.button == 3) or (event.type == pygame.MOUSEMOTION and event.buttons[2]):
+                replay_time = start_time + (end_time - start_time) * event.pos[0] / (screen.get_width() - 1)
+
+        if playing:
+            replay_time += direction * REPLAY_SPEEDS[speed_index] * clock.get_time() / 1000
+        replay_time = min(max(replay_time, start_time), end_time)
+
+        # Only the arrays of the shown tick are read from the file
+        tick = trajectory.tick_at(replay_time)
+        if tick != shown_tick:
+            shown_tick = tick
+            for name, values in trajectory.frame(tick).items():
+                getattr(swarm, name)[:] = values
+            bots = [bot for bot in swarm.bots if swarm.state[bot.index] != REMOVED]
+
+        forming_shape_bots = sum(bot.state == KilobotState.JOINED_SHAPE for bot in bots)
+        texts = [
+            "Controls: ",
+            f"[1]: Display desired shape: {display_desired_shape}",
+            f"[2]: Display grid: {display_grid}",
+            f"[3]: Display gradient: {display_gradient}",
+            f"[4]: Display bots: {display_bots}",
+            f"[SPACE]: Play: {playing}",
+            f"[UP]/[DOWN]: Speed: {REPLAY_SPEEDS[speed_index]}x",
+            f"[R]: Reverse: {direction < 0}",
+            "[LEFT]/[RIGHT]: Step one tick, [HOME]/[END]: Seek to start/end",
+            "Right click or drag to seek, click on a bot for more info",
+            "",
+            f"Replay: {trajectory_dir}",
+            f"Simulation time: {trajectory.times[tick]:.2f} / {end_time:.2f} seconds (tick {tick + 1}/{len(trajectory)})",
+            f"FPS: {int(clock.get_fps())}",
+            f"Total bots: {len(bots)} (Forming shape: {forming_shape_bots})"
+        ]
+        renderer.render(bots, texts, display_grid, display_desired_shape, display_gradient, display_bots)
+
+        clock.tick(RENDER_FPS)
 
     pygame.quit()
-    
 
-main()
\ No newline at end of file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kilobot self-assembly simulation")
+    parser.add_argument("--replay", default=None, metavar="DIR", help="Play back a trajectory recorded with headless.py --record")
+    parser.add_argument("--resume", default=None, metavar="FILE", help="Continue a simulation saved with [C] or headless.py --checkpoint")
+    args = parser.parse_args()
+    if args.replay:
+        replay(args.replay)
+    else:
+        main(args.resume)
\ No newline at end of file
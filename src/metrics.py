@@ -0,0 +1,76 @@
+import numpy as np
+from kilobot import KilobotState
+from array_swarm import ArraySwarm
+
+INITIAL_CAPACITY = 256
+
+
+class Series:
+    # Append-only series backed by a NumPy array that doubles its capacity when full
+    def __init__(self, dtype=float):
+        self.data = np.empty(INITIAL_CAPACITY, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = np.concatenate((self.data, np.empty_like(self.data)))
+        self.data[self.size] = value
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+    def since(self, start):
+        return self.data[start:self.size]
+
+
+class MetricsSink:
+    # Join events of a run, one entry per bot that joined the shape in the order they joined
+    def __init__(self):
+        self.join_ids = Series(np.int64)
+        self.join_times = Series(float)
+        self.location_errors = Series(float)
+        self.forming_counts = Series(np.int64)
+        self.joined_ids = set()
+
+    def record_joins(self, bots, timer, swarm=None):
+        # Called after every update, returns the number of new joined bots
+        if isinstance(swarm, ArraySwarm):
+            return self._record_swarm_joins(swarm, timer)
+        new = 0
+        for bot in bots:
+            if bot.state == KilobotState.JOINED_SHAPE and bot.id not in self.joined_ids:
+                self.joined_ids.add(bot.id)
+                self.join_ids.append(bot.id)
+                self.join_times.append(timer)
+                self.location_errors.append(bot.location_error())
+                self.forming_counts.append(len(self.joined_ids))
+                new += 1
+        return new
+
+    def _record_swarm_joins(self, swarm, timer):
+        # Joined bots never leave the shape, so the tick only has new joined bots if there are more of them
+        joined = np.flatnonzero(swarm.state == KilobotState.JOINED_SHAPE.value)
+        if len(joined) == len(self.joined_ids):
+            return 0
+        new = [row for row, id in zip(joined.tolist(), swarm.ids[joined].tolist()) if id not in self.joined_ids]
+        offsets = swarm.pos[new] - swarm.percieved_pos[new]
+        errors = np.sqrt(offsets[:, 0] ** 2 + offsets[:, 1] ** 2).tolist()
+        for id, error in zip(swarm.ids[new].tolist(), errors):
+            self.joined_ids.add(id)
+            self.join_ids.append(id)
+            self.join_times.append(timer)
+            self.location_errors.append(error)
+            self.forming_counts.append(len(self.joined_ids))
+        return len(new)
+
+    @property
+    def last_join_time(self):
+        return float(self.join_times.values[-1]) if len(self.join_times) else 0
+
+    def __len__(self):
+        return len(self.join_ids)
@@ -0,0 +1,69 @@
+import numpy as np
+
+NOISE_STREAMS = ("distance", "forward", "rotation", "placement", "clock") # Drawing more of one kind of noise does not shift the others
+
+
+class Noise:
+    # Seeded NumPy noise of one run, with an independent stream per kind of noise spawned from the seed.
+    # The errors of a tick are drawn as one block into a preallocated buffer and handed out through a
+    # list iterator, so the hot loops take each value with a single next() call.
+    def __init__(self, seed=None):
+        sequence = np.random.SeedSequence(seed)
+        self.seed = sequence.entropy # Reproduces the run when it was not given a seed
+        children = sequence.spawn(len(NOISE_STREAMS))
+        self.generators = {name: np.random.default_rng(child) for name, child in zip(NOISE_STREAMS, children)}
+        self.keys = {name: child.generate_state(1, np.uint64)[0] for name, child in zip(NOISE_STREAMS, children)} # See keyed
+        self.buffers = {name: np.empty(0) for name in NOISE_STREAMS}
+        self.distance = iter(()) # Errors of the current tick, see errors
+        self.forward = iter(())
+        self.rotation = iter(())
+
+    def draw(self, name, size, error):
+        # Block of size relative errors, uniform in [-error, error). The block is overwritten by the
+        # next draw of the same stream.
+        buffer = self.buffers[name]
+        if len(buffer) < size:
+            buffer = self.buffers[name] = np.empty(max(size, 2 * len(buffer)))
+        block = buffer[:size]
+        self.generators[name].random(out=block)
+        block *= 2 * error
+        block -= error
+        return block
+
+    def errors(self, name, size, error):
+        return iter(self.draw(name, size, error).tolist())
+
+    def one(self, name, error):
+        # A single error, for a bot moved or broadcasting outside a tick or after its block is used up
+        return float(self.draw(name, 1, error)[0])
+
+    def keyed(self, name, error, *keys):
+        # Relative errors, uniform in [-error, error), that only depend on the seed and the keys, e.g. the
+        # tick and the ids of the bots. They do not depend on the order the bots are updated in or on
+        # the process updating them, see partitioned.py.
+        hashes = np.full(np.broadcast(*keys).shape, self.keys[name], dtype=np.uint64)
+        for key in keys:
+            hashes *= _MULTIPLIER
+            hashes += np.asarray(key, dtype=np.uint64)
+        hashes = _mix(hashes)
+        hashes >>= np.uint64(11)
+        return hashes * (2 * error / 2 ** 53) - error
+
+    def normal(self, mean, std):
+        return float(self.generators["placement"].normal(mean, std))
+
+    def uniform(self, low, high):
+        return float(self.generators["placement"].uniform(low, high))
+
+
+_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(x):
+    # SplitMix64 finaliser, arithmetic wraps around modulo 2^64
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
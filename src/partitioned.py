@@ -0,0 +1,241 @@
+import os
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+from math import inf
+import numpy as np
+import kilobot
+from array_swarm import ArraySwarm, SWARM_FIELDS
+
+UPDATED_FIELDS = ("pos", "rotation", "state", "gradient", "percieved_pos", "timer", "prev_distance", "activation_index",
+                  "updates_gradient", "iterations_inside_shape", "use_localise", "joined_shape_time") # Written back by the tiles
+REBALANCE_TICKS = 20 # Ticks between moving the tile borders so every tile keeps about the same number of bots
+
+
+class PartitionedSwarm(ArraySwarm):
+    # ArraySwarm whose arrays live in shared memory and whose ticks are run by worker processes, each one
+    # owning the bots in one vertical strip of the arena. A worker copies the bots of its strip and the
+    # halo of bots within broadcast reach of it, updates the bots it owns and writes them back. Bots that
+    # cross a border migrate to the worker of the next strip, and the borders move every REBALANCE_TICKS.
+    # The noise is keyed by tick and bot ids, so the result does not depend on the number of workers.
+    def __init__(self, n, seed=None, workers=None):
+        super().__init__(n, seed)
+        self.workers = workers or os.cpu_count()
+        self.tick = 0
+        self.edges = None
+        self.shape = None
+        self.specs = {}
+        self._share()
+
+    @classmethod
+    def from_kilobots(cls, bots, seed=None, workers=None):
+        swarm = super().from_kilobots(bots, seed)
+        swarm.workers = workers or swarm.workers
+        return swarm
+
+    def __reduce__(self):
+        # Pickled as plain arrays, the shared memory and the workers are created again when it is loaded
+        arrays = {name: np.array(getattr(self, name)) for name in SWARM_FIELDS}
+        return _restore, (arrays, self.workers, self.next_activation_index, self.tick, self.noise)
+
+    def update_bots(self, dt, shape, enable_trilateration=False, profiler=None):
+        laps = profiler.laps() if profiler is not None else None
+        if not self._processes:
+            self._start()
+        if self.edges is None or self.tick % REBALANCE_TICKS == 0:
+            self.edges = _tile_edges(self.pos[:, 0], self.workers)
+
+        # The shape is only sent when it changes
+        new_shape = shape if shape is not self.shape else None
+        self.shape = shape
+        for connection in self._connections:
+            connection.send((self.tick, dt, enable_trilateration, self.edges, self.next_activation_index, new_shape))
+        replies = [connection.recv() for connection in self._connections]
+        errors = [reply for reply in replies if isinstance(reply, Exception)]
+        if errors:
+            self.close()
+            raise errors[0]
+
+        self.pairs_evaluated = sum(pairs for pairs, _ in replies)
+        self.records_allocated += sum(records for _, records in replies)
+        self.next_activation_index += self.n # Bots activated in a tick are ordered by row, see _Tile._activate
+        self.tick += 1
+        if laps:
+            laps.lap("tiles")
+            profiler.count_tick(self.bots, self.pairs_evaluated, self.records_allocated)
+
+    def close(self):
+        # Stops the workers and moves the arrays out of shared memory, the next tick starts them again
+        for name in self.specs:
+            setattr(self, name, np.array(getattr(self, name)))
+        self._finalizer()
+        self._processes.clear()
+        self._connections.clear()
+        self.specs = {}
+        self.shape = None
+
+    def _keep(self, keep):
+        self.close()
+        super()._keep(keep)
+        self.edges = None
+        self._share()
+
+    def _share(self):
+        # The last arrays exchange the moves and the collisions of a tick between the tiles
+        self._memories, self._processes, self._connections = [], [], []
+        self._finalizer = weakref.finalize(self, _release, self._processes, self._connections, self._memories)
+        self.moved = np.zeros(self.n, dtype=bool)
+        self.moved_pos = np.zeros((self.n, 2))
+        self.blocked = np.zeros(self.n, dtype=bool)
+        self.changed = np.zeros(self.n, dtype=bool)
+        for name in SWARM_FIELDS + ("moved", "moved_pos", "blocked", "changed"):
+            array = getattr(self, name)
+            memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, array.dtype, buffer=memory.buf)
+            shared[:] = array
+            setattr(self, name, shared)
+            self._memories.append(memory)
+            self.specs[name] = (memory.name, array.shape, array.dtype.str)
+
+    def _start(self):
+        if not self.specs:
+            self._share()
+        context = multiprocessing.get_context("spawn")
+        barrier = self._barrier = context.Barrier(self.workers) # Kept alive until the workers have loaded it
+        constants = {name: value for name, value in vars(kilobot).items() if name.isupper()}
+        for index in range(self.workers):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_tile_worker, args=(worker_connection, index, barrier, self.specs, self.noise, constants),
+                                      daemon=True)
+            process.start()
+            self._processes.append(process)
+            self._connections.append(connection)
+
+
+class _Tile(ArraySwarm):
+    # The bots of one strip and its halo, copied out of the shared arrays. Only the owned bots receive
+    # messages, the halo bots are only senders and obstacles.
+    def __init__(self, shared, index, edges, barrier, noise, tick, next_activation_index):
+        x = shared["pos"][:, 0]
+        reach = kilobot.neighbour_cell_size()
+        owned = (x >= edges[index]) & (x < edges[index + 1])
+        self.rows = np.flatnonzero(owned | ((x >= edges[index] - reach) & (x < edges[index + 1] + reach)))
+        self.owned = owned[self.rows]
+        for name in SWARM_FIELDS:
+            setattr(self, name, shared[name][self.rows])
+        self.n = len(self.rows)
+        self.shared = shared
+        self.barrier = barrier
+        self.noise = noise
+        self.tick = tick
+        self.next_activation_index = next_activation_index
+        self.pairs_evaluated = 0
+        self.records_allocated = 0
+        self._views = None
+
+    def write_back(self):
+        rows = self.rows[self.owned]
+        for name in UPDATED_FIELDS:
+            self.shared[name][rows] = getattr(self, name)[self.owned]
+
+    def _candidate_pairs(self, max_distance):
+        receivers, senders = super()._candidate_pairs(max_distance)
+        owned = self.owned[receivers]
+        return receivers[owned], senders[owned]
+
+    def _errors(self, name, error, bots, others=None):
+        if others is None:
+            return self.noise.keyed(name, error, self.tick, self.ids[bots])
+        return self.noise.keyed(name, error, self.tick, self.ids[bots], self.ids[others])
+
+    def _activate(self, activating):
+        # Same order as the sequential numbering of ArraySwarm, without counting the bots of other tiles
+        self.activation_index[activating] = self.next_activation_index + self.rows[activating]
+
+    def _exchange_moves(self, moved, old_pos):
+        # The collision checks see the moves of the halo bots made by the tiles that own them
+        rows = self.rows[self.owned]
+        self.shared["moved"][rows] = moved[self.owned]
+        self.shared["moved_pos"][rows] = self.pos[self.owned]
+        self.barrier.wait()
+        halo = ~self.owned
+        rows = self.rows[halo]
+        moved[halo] = self.shared["moved"][rows]
+        self.pos[halo] = np.where(moved[halo][:, None], self.shared["moved_pos"][rows], old_pos[halo])
+
+    def _exchange_blocked(self, blocked, previous):
+        # Every tile resolves its own bots and reads the halo bots from the tiles that own them, the
+        # collision checks go on while a bot changed in any tile
+        rows = self.rows[self.owned]
+        self.shared["blocked"][rows] = blocked[self.owned]
+        self.shared["changed"][rows] = blocked[self.owned] != previous[self.owned]
+        self.barrier.wait()
+        halo = ~self.owned
+        blocked[halo] = self.shared["blocked"][self.rows[halo]]
+        changed = bool(self.shared["changed"].any())
+        self.barrier.wait() # Every tile read the round before any tile writes the next one
+        return changed
+
+
+def _tile_worker(connection, index, barrier, specs, noise, constants):
+    for name, value in constants.items():
+        setattr(kilobot, name, value)
+    memories = {name: shared_memory.SharedMemory(name=memory_name) for name, (memory_name, _, _) in specs.items()}
+    shared = {name: np.ndarray(shape, dtype, buffer=memories[name].buf) for name, (_, shape, dtype) in specs.items()}
+    shape = None
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        tick, dt, enable_trilateration, edges, next_activation_index, new_shape = command
+        if new_shape is not None:
+            shape = new_shape
+        try:
+            tile = _Tile(shared, index, edges, barrier, noise, tick, next_activation_index)
+            barrier.wait() # Every tile copied its bots before any tile writes
+            tile.update_bots(dt, shape, enable_trilateration)
+            tile.write_back()
+            connection.send((tile.pairs_evaluated, tile.records_allocated))
+        except Exception as error:
+            barrier.abort() # The other tiles stop waiting for this one
+            connection.send(error)
+    shared.clear()
+    for memory in memories.values():
+        memory.close()
+
+
+def _tile_edges(x, workers):
+    # Vertical strips with about the same number of bots each
+    edges = np.full(workers + 1, inf)
+    edges[0] = -inf
+    if len(x):
+        edges[1:-1] = np.quantile(x, np.linspace(0, 1, workers + 1)[1:-1])
+    return edges
+
+
+def _restore(arrays, workers, next_activation_index, tick, noise):
+    swarm = PartitionedSwarm(len(arrays["ids"]), workers=workers)
+    for name, values in arrays.items():
+        getattr(swarm, name)[:] = values
+    swarm.next_activation_index = next_activation_index
+    swarm.tick = tick
+    swarm.noise = noise
+    return swarm
+
+
+def _release(processes, connections, memories):
+    for connection in connections:
+        try:
+            connection.send(None)
+        except OSError:
+            pass
+    for process in processes:
+        process.join(1)
+        if process.is_alive():
+            process.terminate()
+    for memory in memories:
+        try:
+            memory.close()
+        except BufferError: # Arrays still use it, it is freed with them
+            pass
+        memory.unlink()
@@ -0,0 +1,99 @@
+import gc
+import json
+from collections import deque
+from time import perf_counter
+from kilobot import KilobotState
+
+ROLLING_WINDOW = 60 # Samples the rolling averages are taken over
+MAX_TRACE_EVENTS = 1000000 # Tracing stops after this many events so a long run does not run out of memory
+
+
+class PhaseProfiler:
+    # Monotonic timings of named phases and counters, grouped for the HUD. Code that is given no profiler
+    # skips all of it, so profiling costs nothing while it is switched off.
+    def __init__(self, window=ROLLING_WINDOW, trace=True):
+        self.window = window
+        self.samples = {} # name -> deque of the last seconds or counts
+        self.groups = {} # group -> names in the order they were first recorded
+        self.counter_groups = set() # Groups of counts instead of seconds
+        self.trace = [] if trace else None
+        self.last_totals = {} # name -> last value of the cumulative counters
+
+    def laps(self, group="update"):
+        # Consecutive phases, each lap ends the previous one
+        return _Laps(self, group)
+
+    def record(self, name, group, start, end):
+        self._add(name, group, end - start)
+        if self.trace is not None and len(self.trace) < MAX_TRACE_EVENTS:
+            self.trace.append(("X", name, group, start, end - start))
+
+    def count(self, name, value, group="counters"):
+        self.counter_groups.add(group)
+        self._add(name, group, value)
+        if self.trace is not None and len(self.trace) < MAX_TRACE_EVENTS:
+            self.trace.append(("C", name, group, perf_counter(), value))
+
+    def count_tick(self, bots, neighbour_pairs, neighbour_records):
+        # Counters of one tick: candidate pairs the broadcasts evaluated, neighbour records allocated,
+        # garbage collections and bots per state
+        self.count("pairs", neighbour_pairs)
+        self.count("records", self._delta("records", neighbour_records))
+        self.count("gc", self._delta("gc", sum(stats["collections"] for stats in gc.get_stats())))
+        states = dict.fromkeys(KilobotState, 0)
+        for bot in bots:
+            states[bot.state] += 1
+        for state, count in states.items():
+            self.count(state.name, count, "states")
+
+    def average(self, name):
+        samples = self.samples.get(name)
+        return sum(samples) / len(samples) if samples else 0
+
+    def texts(self):
+        # HUD lines, milliseconds for the timed groups and counts for the rest
+        texts = []
+        for group, names in self.groups.items():
+            if group in self.counter_groups:
+                values = [f"{name} {self.average(name):.0f}" for name in names]
+                texts.append(f"{group.capitalize()}: {', '.join(values)}")
+            else:
+                values = [f"{name} {self.average(name) * 1000:.1f}" for name in names]
+                texts.append(f"{group.capitalize()} (ms): {', '.join(values)}")
+        return texts
+
+    def export_trace(self, path):
+        # Chrome trace event format, opened by chrome://tracing, Perfetto and speedscope
+        events = []
+        for kind, name, group, start, value in self.trace or []:
+            if kind == "X":
+                events.append({"name": name, "cat": group, "ph": "X", "ts": start * 1e6, "dur": value * 1e6, "pid": 0, "tid": 0})
+            else:
+                events.append({"name": name, "cat": group, "ph": "C", "ts": start * 1e6, "args": {name: value}, "pid": 0, "tid": 0})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+    def _delta(self, name, total):
+        delta = total - self.last_totals.get(name, total)
+        self.last_totals[name] = total
+        return delta
+
+    def _add(self, name, group, value):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+            self.groups.setdefault(group, []).append(name)
+        samples.append(value)
+
+
+class _Laps:
+    def __init__(self, profiler, group):
+        self.profiler = profiler
+        self.group = group
+        self.last = perf_counter()
+
+    def lap(self, name):
+        now = perf_counter()
+        self.profiler.record(name, self.group, self.last, now)
+        self.last = now
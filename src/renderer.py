@@ -0,0 +1,141 @@
+import pygame
+from kilobot import KILOBOT_RADIUS, draw_bot, draw_bots, gradient_label
+
+BACKGROUND_COLOR = "#f1faee"
+GRID_COLOR = (230, 230, 230)
+HUD_COLOR = (0, 0, 0)
+HUD_LINE_DISTANCE = 20
+MAX_CACHED_TEXTS = 512
+BOT_RECT_MARGIN = 2 # Pixels around the circle, the direction line and the gradient label
+
+
+class Renderer:
+    # Draws the simulation on the screen. The background and the shape are composited once, text and
+    # bot circles are cached, and only the areas around the bots that changed are redrawn.
+    def __init__(self, screen, shape, tile_size, font):
+        self.screen = screen
+        self.shape = shape
+        self.tile_size = tile_size
+        self.font = font
+        self.backgrounds = {} # (display_grid, display_desired_shape) -> Surface
+        self.texts = {} # text -> Surface
+        self.drawn = {} # bot -> (key, rect) of the last frame
+        self.last_options = None
+        self.last_hud_rect = None
+
+    def render(self, bots, texts, display_grid, display_desired_shape, display_gradient, display_bots):
+        background = self._background(display_grid, display_desired_shape)
+        options = (display_grid, display_desired_shape, display_gradient, display_bots)
+        drawn = {}
+        if display_bots:
+            for bot in bots:
+                key = self._key(bot, display_gradient)
+                last = self.drawn.get(bot)
+                drawn[bot] = (key, last[1] if last is not None and last[0] == key else self._rect(bot, display_gradient))
+
+        # The additional info of selected bots can be anywhere, so it always redraws everything
+        full_redraw = options != self.last_options or any(bot.selected_bot for bot in drawn)
+        self.last_options = options
+
+        hud_rect = self._hud_rect(texts)
+        if full_redraw:
+            self.screen.blit(background, (0, 0))
+            if display_bots:
+                draw_bots(self.screen, list(drawn), display_gradient)
+            dirty = [self.screen.get_rect()]
+        else:
+            dirty = [hud_rect]
+            if self.last_hud_rect:
+                dirty.append(self.last_hud_rect)
+            for bot, (key, rect) in self.drawn.items():
+                if bot not in drawn:
+                    dirty.append(rect)
+                elif drawn[bot][0] != key:
+                    dirty.append(rect)
+                    dirty.append(drawn[bot][1])
+            for bot, (key, rect) in drawn.items():
+                if bot not in self.drawn:
+                    dirty.append(rect)
+
+            # Bots touching a dirty area are drawn again, so their whole area is dirty too
+            bot_rects = [rect for key, rect in drawn.values()]
+            redraw = set()
+            touching = dirty
+            while touching:
+                rects = touching
+                touching = []
+                for rect in rects:
+                    for i in rect.collidelistall(bot_rects):
+                        if i not in redraw:
+                            redraw.add(i)
+                            touching.append(bot_rects[i])
+                            dirty.append(bot_rects[i])
+
+            for rect in dirty:
+                self.screen.blit(background, rect, rect)
+            drawn_bots = list(drawn)
+            for i in sorted(redraw):
+                draw_bot(self.screen, drawn_bots[i], display_gradient)
+
+        self._draw_hud(texts)
+        self.drawn = drawn
+        self.last_hud_rect = hud_rect
+        if full_redraw:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+
+    def text(self, text):
+        surface = self.texts.get(text)
+        if surface is None:
+            if len(self.texts) > MAX_CACHED_TEXTS:
+                self.texts.clear()
+            surface = self.font.render(text, True, HUD_COLOR)
+            self.texts[text] = surface
+        return surface
+
+    def invalidate(self):
+        self.last_options = None
+
+    def _background(self, display_grid, display_desired_shape):
+        key = (display_grid, display_desired_shape)
+        if key not in self.backgrounds:
+            width, height = self.screen.get_size()
+            background = pygame.Surface((width, height))
+            background.fill(BACKGROUND_COLOR)
+            if display_grid:
+                for x in range(0, width, self.tile_size):
+                    for y in range(0, height, self.tile_size):
+                        pygame.draw.rect(background, GRID_COLOR, (x, y, self.tile_size, self.tile_size), 1)
+            if display_desired_shape:
+                background.blit(self.shape, (width // 2 - self.shape.get_width() // 2, height // 2 - self.shape.get_height() // 2))
+            if pygame.display.get_surface() is not None:
+                background = background.convert()
+            self.backgrounds[key] = background
+        return self.backgrounds[key]
+
+    def _hud_rect(self, texts):
+        height = self.screen.get_height()
+        top = height - len(texts) * HUD_LINE_DISTANCE
+        width = 10 + max([self.text(text).get_width() for text in texts], default=0)
+        return pygame.Rect(0, top, width, height - top)
+
+    def _draw_hud(self, texts):
+        # Lines are drawn bottom up from the bottom left corner
+        height = self.screen.get_height()
+        for i in range(len(texts)):
+            line_i = len(texts) - i - 1
+            self.screen.blit(self.text(texts[i]), (10, height - (line_i + 1) * HUD_LINE_DISTANCE))
+
+    def _key(self, bot, display_gradient):
+        return (bot.pos, bot.rotation, bot.color, bot.gradient if display_gradient else None)
+
+    def _rect(self, bot, display_gradient):
+        half_width = half_height = KILOBOT_RADIUS
+        if display_gradient:
+            label = gradient_label(bot.gradient)
+            half_width = max(half_width, label.get_width() // 2 + 1)
+            half_height = max(half_height, label.get_height() // 2 + 1)
+        half_width += BOT_RECT_MARGIN
+        half_height += BOT_RECT_MARGIN
+        return pygame.Rect(int(bot.pos[0]) - half_width, int(bot.pos[1]) - half_height, 2 * half_width, 2 * half_height)
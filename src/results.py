@@ -0,0 +1,133 @@
+import os
+import json
+import uuid
+import numpy as np
+try:
+    import fcntl
+except ImportError: # Windows, appends are only kept whole by O_APPEND there
+    fcntl = None
+from atomic_file import atomic_write, write_all
+
+SERIES_COLUMNS = ("errors", "join_times") # Per-bot series that can be stored in the columnar batches
+COLUMNAR_BATCH_SIZE = 64 # Runs per .npz batch when results are buffered
+
+
+class ResultsStore:
+    # Append-only store of simulation runs. Every run is one JSON line of runs_file, appended under an
+    # exclusive lock of the file so concurrent writers never interleave or rewrite each other. With
+    # columnar=True the series of a batch of runs go to one compressed .npz file next to runs_file and
+    # the lines only reference it.
+    def __init__(self, runs_file):
+        self.runs_file = runs_file
+        self.columns_dir = os.path.splitext(runs_file)[0] + "_columns"
+        self.batches = {} # batch file -> {column: array}, loaded lazily
+
+    def append(self, record, columnar=False):
+        return self.append_many([record], columnar)[0]
+
+    def append_many(self, records, columnar=False):
+        if not records:
+            return []
+        records = [dict(record) for record in records]
+        for record in records:
+            record.setdefault("run_id", uuid.uuid4().hex)
+        if columnar and records:
+            self._write_batch(records)
+
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        directory = os.path.dirname(self.runs_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.runs_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX) # Released when fd is closed
+            write_all(fd, lines.encode())
+        finally:
+            os.close(fd)
+        return [record["run_id"] for record in records]
+
+    def runs(self, columns=None):
+        # Yields the runs in the order they were saved with only the given columns, or all of them.
+        # Series in columnar batches are only read when they are asked for.
+        for _, record in self.runs_from(0, columns):
+            yield record
+
+    def runs_from(self, offset, columns=None):
+        # Same as runs, starting at a byte offset of runs_file, and yields the offset after each run with it
+        if not os.path.exists(self.runs_file):
+            return
+        with open(self.runs_file, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                # An unfinished last line is a run that is still being written
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                record = json.loads(line)
+                batch = record.pop("batch", None)
+                batch_index = record.pop("batch_index", None)
+                batch_series = record.pop("batch_series", [])
+                if columns is not None:
+                    record = {name: record[name] for name in columns if name in record}
+                if batch is not None:
+                    for name in batch_series:
+                        if columns is None or name in columns:
+                            record[name] = self._series(batch, name, batch_index)
+                yield offset, record
+
+    def column(self, name):
+        return [record.get(name) for record in self.runs([name])]
+
+    def latest_by_test(self, columns=None):
+        # Last saved run of every test name, like the old output_info.json
+        tests = {}
+        for record in self.runs(None if columns is None else ["test_name", *columns]):
+            test_name = record.pop("test_name", None)
+            if test_name is not None:
+                tests[test_name] = record
+        return tests
+
+    def _write_batch(self, records):
+        batch = f"{uuid.uuid4().hex}.npz"
+        arrays = {"run_ids": np.array([record["run_id"] for record in records])}
+        series_names = [[name for name in SERIES_COLUMNS if name in record] for record in records]
+        for name in SERIES_COLUMNS:
+            series = [np.asarray(record.pop(name, []), dtype=float) for record in records]
+            arrays[name] = np.concatenate(series)
+            arrays[f"{name}_offsets"] = np.cumsum([0] + [len(values) for values in series])
+        for i, record in enumerate(records):
+            record["batch"] = batch
+            record["batch_index"] = i
+            record["batch_series"] = series_names[i]
+
+        with atomic_write(os.path.join(self.columns_dir, batch), sync=True) as f:
+            np.savez_compressed(f, **arrays)
+
+    def _series(self, batch, name, index):
+        arrays = self.batches.setdefault(batch, {})
+        if name not in arrays:
+            with np.load(os.path.join(self.columns_dir, batch)) as npz:
+                arrays[name] = npz[name]
+                arrays[f"{name}_offsets"] = npz[f"{name}_offsets"]
+        offsets = arrays[f"{name}_offsets"]
+        return arrays[name][offsets[index]:offsets[index + 1]].tolist()
+
+
+def import_output_info(json_file, store, columnar=False):
+    # Adds the tests of an old output_info.json file to the store, one run per test name
+    with open(json_file) as f:
+        data = json.load(f)
+    records = [{"test_name": test_name, **info} for test_name, info in data.items()]
+    return store.append_many(records, columnar)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import an output_info.json file into a results store")
+    parser.add_argument("json_file")
+    parser.add_argument("runs_file")
+    parser.add_argument("--columnar", action="store_true", help="Store the error series in a .npz batch")
+    args = parser.parse_args()
+    run_ids = import_output_info(args.json_file, ResultsStore(args.runs_file), args.columnar)
+    print(f"Imported {len(run_ids)} tests into {args.runs_file}")
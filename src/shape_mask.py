@@ -0,0 +1,131 @@
+import io
+import os
+import hashlib
+import numpy as np
+from atomic_file import atomic_write
+
+SHAPE_COLOR = (0, 0, 0)
+ORIGIN_COLOR = (255, 0, 0)
+MAX_EDGE_DISTANCE = 32 # Distances to the edge of the shape are capped to this many pixels
+SHAPE_CACHE_DIR = "info/shape_cache" # Compiled shapes by the hash of their image, see load_compiled_shape
+SHAPE_CACHE_VERSION = 1 # Part of the cache key, increase it when compile_shape changes
+
+
+class CompiledShape:
+    # Shape image compiled to a packed occupancy mask indexed as [x, y], like pygame.surfarray
+    def __init__(self, mask, origin, edge_distance=None):
+        self.width, self.height = mask.shape
+        self.packed = np.packbits(mask, axis=1)
+        self.origin = origin
+        self.area = int(np.count_nonzero(mask))
+        self.edge_distance = edge_distance if edge_distance is not None else signed_edge_distance(mask)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            shape = cls.__new__(cls)
+            shape.packed = arrays["packed"]
+            shape.edge_distance = arrays["edge_distance"]
+            shape.width, shape.height = shape.edge_distance.shape
+            shape.area = int(arrays["area"])
+            origin = arrays["origin"].tolist()
+            shape.origin = tuple(origin) if origin else None
+        return shape
+
+    def save(self, file):
+        np.savez(file, packed=self.packed, edge_distance=self.edge_distance, area=self.area,
+                 origin=np.array(self.origin or (), dtype=np.int64))
+
+    @property
+    def mask(self):
+        return np.unpackbits(self.packed, axis=1, count=self.height).astype(bool)
+
+    def contains(self, pos):
+        x, y = int(pos[0]), int(pos[1])
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return False
+        return bool(self.packed[x, y >> 3] >> (7 - (y & 7)) & 1)
+
+    def contains_many(self, positions):
+        x, y, valid = self._pixels(positions)
+        inside = np.zeros(len(x), dtype=bool)
+        inside[valid] = self.packed[x[valid], y[valid] >> 3] >> (7 - (y[valid] & 7)) & 1
+        return inside
+
+    def distance_to_edge(self, positions):
+        # Signed distance in pixels, positive inside the shape, capped to MAX_EDGE_DISTANCE
+        x, y, valid = self._pixels(positions)
+        distances = np.full(len(x), -MAX_EDGE_DISTANCE, dtype=np.float32)
+        distances[valid] = self.edge_distance[x[valid], y[valid]]
+        return distances
+
+    def _pixels(self, positions):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        x = positions[:, 0].astype(np.int64)
+        y = positions[:, 1].astype(np.int64)
+        valid = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        return x, y, valid
+
+
+def compile_shape(rgb):
+    # rgb is the (width, height, 3) array of the shape image
+    mask = (rgb == SHAPE_COLOR).all(axis=2)
+
+    # Last red pixel in x, y order
+    origin = None
+    origin_pixels = np.flatnonzero((rgb == ORIGIN_COLOR).all(axis=2))
+    if len(origin_pixels) > 0:
+        x, y = np.unravel_index(origin_pixels[-1], mask.shape)
+        origin = (int(x), int(y))
+
+    return CompiledShape(mask, origin)
+
+
+def load_compiled_shape(image_file, cache_dir=SHAPE_CACHE_DIR):
+    # CompiledShape of an image file, from the cache when the same image was compiled before. Only a
+    # cache miss decodes the image, so a cached shape loads in milliseconds and without pygame.
+    with open(image_file, "rb") as f:
+        data = f.read()
+    settings = repr((SHAPE_CACHE_VERSION, SHAPE_COLOR, ORIGIN_COLOR, MAX_EDGE_DISTANCE)).encode()
+    path = os.path.join(cache_dir, hashlib.sha256(data + settings).hexdigest() + ".npz")
+    try:
+        return CompiledShape.load(path)
+    except (OSError, ValueError, KeyError): # Not cached yet, or a damaged file that is written again
+        pass
+
+    import pygame
+    shape = compile_shape(pygame.surfarray.array3d(pygame.image.load(io.BytesIO(data), image_file)))
+    try:
+        with atomic_write(path) as f:
+            shape.save(f)
+    except OSError: # Read-only cache, the shape is compiled again next time
+        pass
+    return shape
+
+
+def signed_edge_distance(mask):
+    inside = _distance_to(mask)
+    outside = _distance_to(~mask)
+    return np.where(mask, outside, -inside).astype(np.float32)
+
+
+def _distance_to(target):
+    # Euclidean distance of every pixel to the nearest target pixel, capped to MAX_EDGE_DISTANCE.
+    # Distances along y first, then the minimum of dx^2 + dy^2 over the columns within the cap.
+    width, height = target.shape
+    cap = MAX_EDGE_DISTANCE
+    index = np.arange(height)
+    previous = np.maximum.accumulate(np.where(target, index, -2 * cap), axis=1)
+    following = np.minimum.accumulate(np.where(target, index, height + 2 * cap)[:, ::-1], axis=1)[:, ::-1]
+    column_distance = np.minimum(np.minimum(index - previous, following - index), cap).astype(np.float32)
+    column_distance **= 2
+
+    squared = np.full((width, height), np.float32(cap * cap))
+    for dx in range(-cap, cap + 1):
+        if dx < 0:
+            np.minimum(squared[:dx], column_distance[-dx:] + dx * dx, out=squared[:dx])
+        elif dx > 0:
+            np.minimum(squared[dx:], column_distance[:-dx] + dx * dx, out=squared[dx:])
+        else:
+            np.minimum(squared, column_distance, out=squared)
+    return np.sqrt(squared)
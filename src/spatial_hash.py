@@ -0,0 +1,50 @@
+from math import floor
+
+
+class SpatialHash:
+    def __init__(self, cell_size:float):
+        self.cell_size = cell_size
+        self.cells = {} # Dict of (cell_x, cell_y) -> list of bots
+
+    def cell_of(self, pos):
+        return (floor(pos[0] / self.cell_size), floor(pos[1] / self.cell_size))
+
+    def rebuild(self, bots):
+        self.cells.clear()
+        for bot in bots:
+            self.insert(bot)
+
+    def insert(self, bot):
+        cell = self.cell_of(bot.pos)
+        if cell in self.cells:
+            self.cells[cell].append(bot)
+        else:
+            self.cells[cell] = [bot]
+
+    def remove(self, bot, pos=None):
+        # pos is where the bot was inserted, if it moved since
+        cell = self.cell_of(bot.pos if pos is None else pos)
+        bots = self.cells[cell]
+        bots.remove(bot)
+        if not bots:
+            del self.cells[cell]
+
+    def move(self, bot, old_pos):
+        if self.cell_of(old_pos) != self.cell_of(bot.pos):
+            self.remove(bot, old_pos)
+            self.insert(bot)
+
+    def candidates(self, cell):
+        # Bots in the 3x3 block of cells centered on cell. Any bot within cell_size of a
+        # point inside cell is guaranteed to be in this list.
+        cx, cy = cell
+        candidates = []
+        for x in (cx - 1, cx, cx + 1):
+            for y in (cy - 1, cy, cy + 1):
+                bots = self.cells.get((x, y))
+                if bots:
+                    candidates.extend(bots)
+        return candidates
+
+    def query(self, pos):
+        return self.candidates(self.cell_of(pos))
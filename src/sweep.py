@@ -0,0 +1,148 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import kilobot
+from headless import run_headless, DEFAULT_IMAGE_FILE, DEFAULT_DT, DEFAULT_MAX_TIME, RESUMED_SETTINGS
+from checkpoint import fork_checkpoint
+from results import ResultsStore, COLUMNAR_BATCH_SIZE
+
+# Parameters that are passed to run_headless, every other parameter must be a kilobot.py constant
+RUN_PARAMETERS = {
+    "shape": "image_file",
+    "rows": "rows",
+    "cols": "cols",
+    "enable_trilateration": "enable_trilateration",
+    "dt": "dt",
+    "max_time": "max_time",
+    "use_array_engine": "use_array_engine",
+    "incremental_gradient": "incremental_gradient",
+    "use_active_set": "use_active_set",
+    "converge": "converge",
+}
+DEFAULT_CONSTANTS = {name: value for name, value in vars(kilobot).items() if name.isupper()}
+
+
+def expand_grid(parameters, repetitions, base_seed=0):
+    # One job per combination of parameter values and repetition, each with its own seed
+    for name in parameters:
+        if name not in RUN_PARAMETERS and name not in DEFAULT_CONSTANTS:
+            raise ValueError(f"Unknown sweep parameter {name}")
+
+    names = list(parameters)
+    jobs = []
+    for values in itertools.product(*[parameters[name] for name in names]):
+        for repetition in range(repetitions):
+            jobs.append({"params": dict(zip(names, values)), "repetition": repetition, "seed": base_seed + len(jobs)})
+    return jobs
+
+
+def run_job(job, defaults):
+    # Runs in a worker process, constants are reset so jobs do not leak into each other
+    for name, value in DEFAULT_CONSTANTS.items():
+        setattr(kilobot, name, value)
+
+    # Runs resumed from a checkpoint are forks of it, the swept settings replace the ones it was saved with
+    run_args = dict(defaults)
+    variant = {}
+    for name, value in job["params"].items():
+        if run_args.get("resume") and RUN_PARAMETERS.get(name) in RESUMED_SETTINGS:
+            variant[RUN_PARAMETERS[name]] = value
+        elif name in RUN_PARAMETERS:
+            run_args[RUN_PARAMETERS[name]] = value
+        else:
+            setattr(kilobot, name, value)
+    if run_args.get("resume"):
+        run_args["resume"] = next(fork_checkpoint(run_args["resume"], [variant]))
+
+    # Runs resumed from a checkpoint keep its noise streams in the first repetition, so forks of the same
+    # checkpoint only differ in their parameters
+    seed = job["seed"]
+    if run_args.get("resume") and job["repetition"] == 0:
+        seed = None
+
+    start = time.perf_counter()
+    result = run_headless(seed=seed, **run_args)
+    result.update(job)
+    result["wall_time"] = time.perf_counter() - start
+    return result
+
+
+def run_sweep(parameters, repetitions, output_file, workers=None, base_seed=0, defaults=None, columnar=False):
+    # Returns the results of the runs, and the failed jobs with their error. A failed job does not stop
+    # the others and is not saved.
+    jobs = expand_grid(parameters, repetitions, base_seed)
+    defaults = defaults or {}
+    results = []
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(run_job, job, defaults): job for job in jobs}
+        # Results are saved by this process only, one run as they complete or one batch of runs if columnar
+        store = ResultsStore(output_file)
+        pending = []
+        try:
+            for i, future in enumerate(as_completed(futures)):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failures.append(dict(job, error=repr(error)))
+                    print(f"[{i + 1}/{len(jobs)}] {job['params']} seed {job['seed']}: failed with {error!r}", file=sys.stderr)
+                    continue
+                if columnar:
+                    pending.append(result)
+                    if len(pending) == COLUMNAR_BATCH_SIZE:
+                        store.append_many(pending, columnar)
+                        pending = []
+                else:
+                    store.append(result)
+                results.append(result)
+                print(f"[{i + 1}/{len(jobs)}] {result['params']} seed {result['seed']}: "
+                      f"{result['bots']} bots, average error {result['average_error']}")
+        finally:
+            store.append_many(pending, columnar)
+    return results, failures
+
+
+def parse_parameter(text):
+    # NAME=v1,v2,... with each value parsed as JSON when possible
+    name, _, values = text.partition("=")
+    parsed = []
+    for value in values.split(","):
+        try:
+            parsed.append(json.loads(value))
+        except json.JSONDecodeError:
+            parsed.append(value)
+    return name, parsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a grid of headless simulations over a process pool")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=V1,V2",
+                        help=f"Sweep parameter, one of {', '.join(RUN_PARAMETERS)} or a kilobot.py constant")
+    parser.add_argument("--repetitions", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to the number of cores")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first run, the following runs use the next seeds")
+    parser.add_argument("--shape", default=DEFAULT_IMAGE_FILE)
+    parser.add_argument("--dt", type=float, default=None, help=f"Simulated seconds per update, defaults to {DEFAULT_DT} or that of --resume")
+    parser.add_argument("--max-time", type=float, default=DEFAULT_MAX_TIME)
+    parser.add_argument("--array-engine", action="store_true", help="Use the NumPy swarm engine")
+    parser.add_argument("--converge", action="store_true", help="End every run once it converged, see convergence.py")
+    parser.add_argument("--resume", default=None, metavar="FILE", help="Fork every run from this checkpoint of headless.py")
+    parser.add_argument("--output", default="info/sweep_results.jsonl", help="JSON Lines results file the runs are appended to")
+    parser.add_argument("--columnar", action="store_true", help=f"Store the error series in a .npz file per {COLUMNAR_BATCH_SIZE} runs")
+    args = parser.parse_args(argv)
+
+    parameters = dict(parse_parameter(param) for param in args.param)
+    defaults = {"image_file": args.shape, "dt": args.dt, "max_time": args.max_time, "use_array_engine": args.array_engine, "resume": args.resume,
+                "converge": args.converge}
+    _, failures = run_sweep(parameters, args.repetitions, args.output, args.workers, args.seed, defaults, args.columnar)
+    if failures:
+        sys.exit(f"{len(failures)} runs failed")
+
+
+if __name__ == "__main__":
+    main()
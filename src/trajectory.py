@@ -0,0 +1,91 @@
+import os
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+from atomic_file import atomic_write
+
+# Arrays recorded every tick, one .npy file each with shape (max_ticks, bots, ...)
+FIELDS = {
+    "pos": (np.float32, (2,)),
+    "rotation": (np.float32, ()),
+    "state": (np.int8, ()),
+    "gradient": (np.float32, ()),
+    "percieved_pos": (np.float32, (2,)),
+}
+REMOVED = -1 # State of the bots that were removed from the simulation
+FLUSH_TICKS = 100 # Ticks between flushes of the arrays and the metadata to disk
+
+
+class TrajectoryRecorder:
+    # Writes the bots of every tick to memory-mapped arrays preallocated for max_ticks ticks in directory.
+    # Bots are columns in the order of the first tick, bots that are removed later keep the REMOVED state.
+    def __init__(self, directory, bots, max_ticks, **info):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_ticks = max_ticks
+        self.ticks = 0
+        self.columns = {bot.id: i for i, bot in enumerate(bots)}
+        self.info = dict(info, ids=list(self.columns), is_seed=[bool(bot.is_seed) for bot in bots])
+        self.arrays = {name: open_memmap(os.path.join(directory, f"{name}.npy"), "w+", dtype, (max_ticks, len(bots), *shape))
+                       for name, (dtype, shape) in FIELDS.items()}
+        self.times = open_memmap(os.path.join(directory, "time.npy"), "w+", np.float64, (max_ticks,))
+        self._write_info()
+
+    def record(self, bots, time):
+        columns = [self.columns[bot.id] for bot in bots]
+        self._write(columns, {
+            "pos": [bot.pos for bot in bots],
+            "rotation": [bot.rotation for bot in bots],
+            "state": [bot.state.value for bot in bots],
+            "gradient": [bot.gradient for bot in bots],
+            "percieved_pos": [bot.percieved_pos for bot in bots],
+        }, time)
+
+    def record_swarm(self, swarm, time):
+        columns = [self.columns[id] for id in swarm.ids.tolist()]
+        self._write(columns, {name: getattr(swarm, name) for name in FIELDS}, time)
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.times.flush()
+        self._write_info()
+
+    def _write(self, columns, values, time):
+        tick = self.ticks
+        if tick == self.max_ticks:
+            raise ValueError(f"Trajectory in {self.directory} is full after {self.max_ticks} ticks")
+        if len(columns) < len(self.columns):
+            self.arrays["state"][tick] = REMOVED
+        for name, array in self.arrays.items():
+            array[tick, columns] = values[name]
+        self.times[tick] = time
+        self.ticks += 1
+        if self.ticks % FLUSH_TICKS == 0:
+            self.close()
+
+    def _write_info(self):
+        with atomic_write(os.path.join(self.directory, "info.json"), "w") as f:
+            json.dump(dict(self.info, ticks=self.ticks), f)
+
+
+class Trajectory:
+    # Read-only view of a recorded trajectory, ticks are only read from disk when they are accessed
+    def __init__(self, directory):
+        with open(os.path.join(directory, "info.json")) as f:
+            self.info = json.load(f)
+        self.ticks = self.info["ticks"]
+        self.ids = np.array(self.info["ids"], dtype=np.int64)
+        self.is_seed = np.array(self.info["is_seed"], dtype=bool)
+        self.arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")[:self.ticks] for name in FIELDS}
+        self.times = np.load(os.path.join(directory, "time.npy"), mmap_mode="r")[:self.ticks]
+
+    def __len__(self):
+        return self.ticks
+
+    def frame(self, tick):
+        return {name: array[tick] for name, array in self.arrays.items()}
+
+    def tick_at(self, time):
+        # Last tick recorded at or before time
+        return min(max(int(np.searchsorted(self.times, time, side="right")) - 1, 0), self.ticks - 1)
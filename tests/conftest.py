@@ -0,0 +1,33 @@
+import os
+import sys
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC_DIR)
+
+
+@pytest.fixture(autouse=True)
+def src_dir(monkeypatch):
+    # Shapes and the shape cache are found relative to src, like when the scripts are run from it
+    monkeypatch.chdir(SRC_DIR)
+
+
+@pytest.fixture
+def shape():
+    from shape_mask import load_compiled_shape
+    return load_compiled_shape("shapes/arrow.png")
+
+
+@pytest.fixture
+def new_run():
+    # Resets the class counters and seeds the noise, like run_headless does for a new run
+    from kilobot import Kilobot
+    from noise import Noise
+
+    def reset(seed):
+        Kilobot.noise = Noise(seed)
+        Kilobot.next_id = 0
+        Kilobot.next_activation_index = 0
+        Kilobot.spatial_hash = None
+        Kilobot.frozen_hash = None
+    return reset
@@ -0,0 +1,20 @@
+import numpy as np
+import kilobot
+from kilobot import generate_kilobots, update_bots
+from array_swarm import ArraySwarm
+
+
+def test_same_run_as_object_engine(shape, new_run, monkeypatch):
+    # Without noise both engines compute the same values in the same order, so every tick is identical
+    monkeypatch.setattr(kilobot, "DISABLE_DISTANCE_ERROR", True)
+    monkeypatch.setattr(kilobot, "DISABLE_MOVEMENT_ERROR", True)
+    new_run(1)
+    bots = generate_kilobots(shape.origin, 4, 5)
+    swarm = ArraySwarm.from_kilobots(bots, 1)
+    for tick in range(1500):
+        update_bots(bots, 0.1, shape, True)
+        swarm.update_bots(0.1, shape, True)
+        assert np.array_equal([bot.state.value for bot in bots], swarm.state), tick
+        assert np.array_equal([bot.gradient for bot in bots], swarm.gradient), tick
+        assert np.array_equal([bot.pos for bot in bots], swarm.pos), tick
+    assert np.any(swarm.state == kilobot.KilobotState.JOINED_SHAPE.value)
@@ -0,0 +1,49 @@
+from kilobot import KilobotState, generate_kilobots, update_bots, remove_bots_not_forming_shape
+from active_set import ActiveSet
+from gradient_field import GradientField
+from event_engine import EventEngine
+from checkpoint import save_checkpoint, load_checkpoint
+
+
+def test_checkpoint_after_removing_bots(tmp_path, shape, new_run):
+    new_run(1)
+    bots = generate_kilobots(shape.origin, 4, 5)
+    active_set = ActiveSet()
+    gradient_field = GradientField()
+    for _ in range(100):
+        update_bots(bots, 0.1, shape, True, gradient_field, active_set)
+    assert any(bot.id in gradient_field.nodes and bot.state != KilobotState.JOINED_SHAPE for bot in bots)
+
+    # Same as [ESC] in main.py
+    bots = remove_bots_not_forming_shape(bots)
+    active_set.sync(bots)
+    gradient_field.prune(bots)
+    path = str(tmp_path / "checkpoint.pkl")
+    save_checkpoint(path, 10, "shapes/arrow.png", bots, None, gradient_field, active_set)
+
+    checkpoint = load_checkpoint(path)
+    assert [bot.id for bot in checkpoint["bots"]] == [bot.id for bot in bots]
+    assert set(checkpoint["gradient_field"].nodes) <= {bot.id for bot in bots}
+    assert checkpoint["active_set"].bots is checkpoint["bots"]
+    update_bots(checkpoint["bots"], 0.1, shape, True, checkpoint["gradient_field"], checkpoint["active_set"])
+
+
+def test_event_engine_checkpoint_after_removing_bots(tmp_path, shape, new_run):
+    new_run(1)
+    bots = generate_kilobots(shape.origin, 4, 5)
+    engine = EventEngine(bots, 0.1)
+    for _ in range(100):
+        engine.update_bots(0.1, shape, True)
+
+    engine.remove_bots_not_forming_shape()
+    kept = set(engine.bots)
+    assert len(kept) < len(bots)
+    for bot_dict in (engine.inboxes, engine.periods, engine.phases, engine.last_steps, engine.next_steps, engine.sent):
+        assert set(bot_dict) <= kept
+    assert all(event[3] in kept for event in engine.events)
+
+    path = str(tmp_path / "checkpoint.pkl")
+    save_checkpoint(path, 10, "shapes/arrow.png", engine.bots, engine)
+    checkpoint = load_checkpoint(path)
+    assert checkpoint["swarm"].bots == checkpoint["bots"]
+    checkpoint["swarm"].update_bots(0.1, shape, True)
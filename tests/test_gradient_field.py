@@ -0,0 +1,39 @@
+import kilobot
+from kilobot import Kilobot, generate_kilobots, update_bots
+from noise import Noise
+from active_set import ActiveSet
+from gradient_field import GradientField
+
+
+def run_both(shape, monkeypatch, ticks, rows, cols, seed):
+    # Two copies of the same run, with and without the gradient field, compared after every tick
+    runs = []
+    for gradient_field in (None, GradientField()):
+        Kilobot.noise = Noise(seed)
+        Kilobot.next_id = 0
+        Kilobot.next_activation_index = 0
+        runs.append([generate_kilobots(shape.origin, rows, cols), ActiveSet(), gradient_field, Noise(seed), 0])
+    for tick in range(ticks):
+        for run in runs:
+            bots, active_set, gradient_field, noise, next_activation_index = run
+            Kilobot.noise = noise
+            Kilobot.next_activation_index = next_activation_index
+            update_bots(bots, 0.1, shape, True, gradient_field, active_set)
+            run[4] = Kilobot.next_activation_index
+        (bots, *_), (field_bots, *_) = runs
+        assert [bot.gradient for bot in bots] == [bot.gradient for bot in field_bots], tick
+        assert [(bot.state, bot.pos) for bot in bots] == [(bot.state, bot.pos) for bot in field_bots], tick
+    return runs
+
+
+def test_same_gradients_as_form_gradient(shape, monkeypatch):
+    monkeypatch.setattr(kilobot, "DISABLE_DISTANCE_ERROR", True)
+    monkeypatch.setattr(kilobot, "DISABLE_MOVEMENT_ERROR", True)
+    run_both(shape, monkeypatch, 1500, 4, 5, 3)
+
+
+def test_same_gradients_with_noisy_distances(shape, monkeypatch):
+    # A wide distance error puts many pairs near GRADIENT_DISTANCE, where every tick may add or drop their edge
+    monkeypatch.setattr(kilobot, "DISTANCE_ERROR", 0.3)
+    runs = run_both(shape, monkeypatch, 1500, 4, 5, 3)
+    assert runs[1][2].uncertain
@@ -0,0 +1,17 @@
+from kilobot import Kilobot
+
+
+def test_bot_moves_and_broadcasts_outside_a_tick(new_run):
+    new_run(1)
+    bot = Kilobot((0.0, 0.0), 0.0)
+    other = Kilobot((50.0, 0.0), 0.0)
+
+    bot.move_straight(1)
+    assert bot.pos[0] > 0
+    rotation = bot.rotation
+    bot.rotate_left(1)
+    bot.rotate_right(1)
+    bot.rotate_right(1)
+    assert bot.rotation != rotation
+    bot.broadcast([other])
+    assert [record.bot for record in other.neighbours] == [bot]
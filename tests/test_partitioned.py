@@ -0,0 +1,38 @@
+import numpy as np
+import kilobot
+from kilobot import generate_kilobots
+from array_swarm import ArraySwarm
+from partitioned import PartitionedSwarm
+
+
+def test_workers_start_again_after_close(shape, new_run):
+    new_run(1)
+    swarm = PartitionedSwarm.from_kilobots(generate_kilobots(shape.origin, 3, 4), 1, workers=2)
+    try:
+        swarm.update_bots(0.1, shape, True)
+        swarm.close()
+        swarm.update_bots(0.1, shape, True)
+        assert swarm.tick == 2
+        assert all(process.is_alive() for process in swarm._processes)
+    finally:
+        swarm.close()
+
+
+def test_same_run_as_array_swarm(shape, new_run, monkeypatch):
+    # The workers get the constants of the parent when they start, so the errors stay disabled there too
+    monkeypatch.setattr(kilobot, "DISABLE_DISTANCE_ERROR", True)
+    monkeypatch.setattr(kilobot, "DISABLE_MOVEMENT_ERROR", True)
+    new_run(1)
+    bots = generate_kilobots(shape.origin, 4, 5)
+    swarm = ArraySwarm.from_kilobots(bots, 1)
+    partitioned = PartitionedSwarm.from_kilobots(bots, 1, workers=2)
+    try:
+        for tick in range(1500):
+            swarm.update_bots(0.1, shape, True)
+            partitioned.update_bots(0.1, shape, True)
+            assert np.array_equal(swarm.state, partitioned.state), tick
+            assert np.array_equal(swarm.gradient, partitioned.gradient), tick
+            assert np.array_equal(swarm.pos, partitioned.pos), tick
+    finally:
+        partitioned.close()
+    assert np.any(swarm.state == kilobot.KilobotState.JOINED_SHAPE.value)
@@ -0,0 +1,18 @@
+from concurrent.futures import ProcessPoolExecutor
+from results import ResultsStore
+
+
+def append_runs(runs_file, writer):
+    # Records far larger than a pipe buffer, so unlocked appends could be split
+    store = ResultsStore(runs_file)
+    for i in range(20):
+        store.append({"writer": writer, "index": i, "errors": [float(writer)] * 20000})
+
+
+def test_concurrent_appends_do_not_interleave(tmp_path):
+    runs_file = str(tmp_path / "runs.jsonl")
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(append_runs, [runs_file] * 4, range(4)))
+    runs = list(ResultsStore(runs_file).runs())
+    assert sorted((run["writer"], run["index"]) for run in runs) == [(writer, i) for writer in range(4) for i in range(20)]
+    assert all(run["errors"] == [float(run["writer"])] * 20000 for run in runs)
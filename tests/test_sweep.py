@@ -0,0 +1,16 @@
+from results import ResultsStore
+from sweep import run_sweep
+
+
+def test_failed_runs_do_not_stop_the_sweep(tmp_path):
+    output_file = str(tmp_path / "sweep.jsonl")
+    parameters = {"shape": ["shapes/arrow.png", "shapes/missing.png"]}
+    defaults = {"rows": 2, "cols": 2, "max_time": 1}
+    results, failures = run_sweep(parameters, 2, output_file, workers=2, defaults=defaults, columnar=True)
+
+    assert [result["params"]["shape"] for result in results] == ["shapes/arrow.png"] * 2
+    assert [failure["params"]["shape"] for failure in failures] == ["shapes/missing.png"] * 2
+    assert all("FileNotFoundError" in failure["error"] for failure in failures)
+    saved = list(ResultsStore(output_file).runs())
+    assert sorted(run["seed"] for run in saved) == sorted(result["seed"] for result in results)
+    assert all(len(run["errors"]) == len(run["join_times"]) for run in saved)